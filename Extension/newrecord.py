@@ -3,21 +3,107 @@ import scipy.stats as st
 from Extension.record import Record
 
 class Newrecord(Record):
+    """
+    Record used by the accrual FD. Besides the arrival times, it keeps the count, the sum and the sum of squares of the
+    valid differences between adjacent arrival times, updated when a difference enters or leaves the ring buffer, so
+    that the mean and the standard deviation of the differences cost O(1) per heartbeat. The differences are shifted by
+    the first one before being summed to keep the sums small, and the sums are recomputed from the buffer every
+    max(n, resum_period) appends so that float errors cannot drift. The normal quantile of phi is computed once.
+    """
+
+    resum_period = 1000
+
     def __init__(self, n, delta, phi):
         Record.__init__(self, n)
         self.delta = delta
         self.phi = phi
+        self.quantile = st.norm.ppf(1 - np.power(0.1, phi))
+        self.shift = None
+        self.difference_count = 0
+        self.difference_sum = 0.0
+        self.difference_square_sum = 0.0
+        self.updates = 0
 
-    def get_interval(self):
-        difference = self.get_difference()
+    def append(self, a):
+        slot = None
+        if self.current_length >= 1 and self.max_length > 1:
+            # the slot of the ring buffer of differences that Record.append is going to overwrite
+            if self.current_length < self.max_length:
+                slot = self.end_pointer_difference
+            else:
+                slot = self.start_pointer_difference
+            old = self.difference[slot]
+
+        earliest_value = Record.append(self, a)
+
+        if slot is not None:
+            new = self.difference[slot]
+            if self.shift is None and new >= 0:
+                self.shift = new
+            if old >= 0:
+                self.difference_count -= 1
+                self.difference_sum -= old - self.shift
+                self.difference_square_sum -= (old - self.shift) ** 2
+            if new >= 0:
+                self.difference_count += 1
+                self.difference_sum += new - self.shift
+                self.difference_square_sum += (new - self.shift) ** 2
+            self.updates += 1
+            if self.updates >= max(self.max_length, self.resum_period):
+                self.resum()
+        return earliest_value
+
+    def resum(self):
+        """
+        This method is used to recompute the sums of the differences from the ring buffer, removing the float errors
+        accumulated by the incremental updates.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.updates = 0
+        if self.shift is None:
+            return
+        shifted = self.get_difference() - self.shift
+        self.difference_count = len(shifted)
+        self.difference_sum = float(np.sum(shifted))
+        self.difference_square_sum = float(np.sum(shifted * shifted))
 
-        if len(difference) == 0:
+    def get_mean(self):
+        """
+        This method is used to get the mean of the differences between adjacent arrival times in O(1).
+
+        Args:
+            None
+
+        Returns:
+            float: the mean of the differences, same as np.mean(self.get_difference())
+        """
+        return self.shift + self.difference_sum / self.difference_count
+
+    def get_std(self):
+        """
+        This method is used to get the standard deviation of the differences between adjacent arrival times in O(1).
+
+        Args:
+            None
+
+        Returns:
+            float: the standard deviation of the differences, same as np.std(self.get_difference())
+        """
+        mean = self.difference_sum / self.difference_count
+        variance = self.difference_square_sum / self.difference_count - mean * mean
+        return np.sqrt(variance) if variance > 0 else 0.0
+
+    def get_interval(self):
+        if self.difference_count == 0:
             interval = self.delta
-        elif len(difference) == 1:
-            interval = difference[0]
+        elif self.difference_count == 1:
+            interval = self.shift + self.difference_sum
         else:
-            mean = np.mean(difference)
-            scale = np.std(difference)
-            interval = st.norm.ppf(1 - np.power(0.1, self.phi), loc=mean, scale=scale)
+            interval = self.get_mean() + self.quantile * self.get_std()
 
         return interval
@@ -1,6 +1,10 @@
 import pandas as pd
 import numpy as np
 from Extension.record import Record
+from Extension.newrecord import Newrecord
+from qos import qos_from_expected
+from window_stats import WindowStats
+from grid_sweep import parameter_grid, grid_frame
 import matplotlib.pyplot as plt
 import scipy.stats as st
 import os
@@ -15,29 +19,19 @@ def accural_estimate_for_single_value(enviornment, delta_i, n, phi):
 
     mistake_duration = 0
     next_expected_arrival_time = enviornment[0]
-    record = Record(n)
+    # Newrecord keeps running statistics of the differences, so each heartbeat costs O(1) and no scipy call
+    record = Newrecord(n, delta_i, phi)
     wrong_count = 0
 
     for arrival_time in enviornment:
         record.append(arrival_time)
-        difference = record.get_difference()
 
         if arrival_time > next_expected_arrival_time:
             mistake_duration += arrival_time - next_expected_arrival_time
             wrong_count += 1
 
         # Then start to calculate the expected arrival time
-        if len(difference) == 0:
-            # Means there are only one arrival time in the record
-            next_expected_arrival_time = arrival_time + delta_i
-        elif len(difference) == 1:
-            # Means there are only two arrival time in the record
-            next_expected_arrival_time = arrival_time + difference[0]
-        else:
-            mean = np.mean(difference)
-            scale = np.std(difference)
-            expected_interval = st.norm.ppf(1 - np.power(0.1, phi), loc=mean, scale=scale)
-            next_expected_arrival_time = arrival_time + expected_interval
+        next_expected_arrival_time = arrival_time + record.get_interval()
 
     detection_time = next_expected_arrival_time - enviornment[-1]
     pa = (len(enviornment) - wrong_count) / len(enviornment)
@@ -48,6 +42,59 @@ def accural_estimate_for_single_value(enviornment, delta_i, n, phi):
     # q.put( (mistake_duration, detection_time, pa, cpu_time, memory) )
 
 
+def accural_sweep_phi(enviornment, delta_i, n, phi_array, stats=None):
+    """
+    This function is used to evaluate the accrual FD for any number of phi values at once. When the Record holds at
+    least two differences, the arrival time k + 1 is late exactly when its standardized slack
+    (gap - mean) / std is larger than z(phi) = norm.ppf(1 - 0.1 ** phi), and it then adds std * (slack - z(phi)) to the
+    mistake duration. The standardized slacks are computed and sorted once, then every phi is answered by a binary
+    search in the cumulative sums. The heartbeats whose expected arrival time does not depend on phi (fewer than two
+    differences in the Record, or a zero standard deviation) are counted once for all phi values.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int): size of the window
+        phi_array (np.array): values of phi to evaluate
+        stats (WindowStats): window statistics of enviornment, built if not given
+
+    Returns:
+        tuple: (mistake_duration, wrong_count, pa), each an np.array with the same length as phi_array
+    """
+    if stats is None:
+        stats = WindowStats(enviornment)
+    count, mean, std = stats.difference_statistics(n)
+    count, mean, std = count[:-1], mean[:-1], std[:-1]
+    gap = stats.difference
+
+    # expected intervals that do not depend on phi
+    fixed_interval = np.where(count == 0, delta_i, mean)
+    fixed = (count < 2) | (std == 0)
+    fixed_slack = gap[fixed] - fixed_interval[fixed]
+    fixed_duration = np.sum(fixed_slack[fixed_slack > 0])
+    fixed_count = np.count_nonzero(fixed_slack > 0)
+
+    excess = gap[~fixed] - mean[~fixed]
+    scale = std[~fixed]
+    standardized = excess / scale
+    order = np.argsort(standardized)
+    standardized = standardized[order]
+    # suffix sums of the excess and of the std, in the order of the standardized slack
+    excess_suffix = np.concatenate((np.cumsum(excess[order][::-1])[::-1], [0.0]))
+    scale_suffix = np.concatenate((np.cumsum(scale[order][::-1])[::-1], [0.0]))
+
+    z = st.norm.ppf(1 - np.power(0.1, np.asarray(phi_array, dtype=float)))
+    position = np.searchsorted(standardized, z, side='right')
+    wrong_count = fixed_count + len(standardized) - position
+    with np.errstate(invalid='ignore'):
+        # z is infinite for phi = 0 or very large phi, where no (resp. every) standardized slack is involved
+        variable_duration = np.where(position < len(standardized), excess_suffix[position] - z * scale_suffix[position],
+                                     0.0)
+    mistake_duration = fixed_duration + variable_duration
+    pa = (len(enviornment) - wrong_count) / len(enviornment)
+    return mistake_duration, wrong_count, pa
+
+
 def accural_estimate_for_phi_array(enviornment, delta_i, n, phi_array):
     length = len(phi_array)
     mistake_duration = np.zeros(length, dtype=float)
@@ -77,40 +124,73 @@ def accural_estimate_for_phi_array(enviornment, delta_i, n, phi_array):
     return mistake_duration
 
 
-def accural_estimate_for_n_array(enviornment, delta_i, n_array, phi):
-    length = len(n_array)
-    mistake_duration = np.zeros(length, dtype=float)
-    expected_arrival_time = np.array([enviornment[0] for i in range(length)], dtype=float)
-    record_list = [Record(i) for i in n_array]
-    interval_list = np.zeros(length, dtype=float)
+def accural_expected_arrival_time(enviornment, delta_i, n, phi, stats=None):
+    """
+    This function is used to calculate every next expected arrival time of the accrual FD at once, from the difference
+    statistics given by WindowStats instead of a Record. A zero standard deviation gives the mean as expected interval.
 
-    for arrival_time in enviornment:
-        for inx, record in enumerate(record_list):
-            record.append(arrival_time)
-            difference = record.get_difference()
-
-            # Then start to calculate the expected arrival time
-            if len(difference) == 0:
-                # Means there are only one arrival time in the record
-                expected_interval = delta_i
-            elif len(difference) == 1:
-                # Means there are only two arrival time in the record
-                expected_interval = difference[0]
-            else:
-                mean = np.mean(difference)
-                scale = np.std(difference)
-                expected_interval = st.norm.ppf(1 - np.power(0.1, phi), loc=mean, scale=scale)
-
-            interval_list[inx] = expected_interval
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int or np.array): size of the window, an array of shape (m, 1) gives one row per window size
+        phi (float): threshold of the suspicion level
+        stats (WindowStats): window statistics of enviornment, built if not given
 
-        duration = -expected_arrival_time + arrival_time
-        duration = np.maximum(duration, 0)
-        mistake_duration += duration
+    Returns:
+        np.array: the next expected arrival time computed after each arrival time
+    """
+    if stats is None:
+        stats = WindowStats(enviornment)
+    count, mean, std = stats.difference_statistics(n)
+    z = st.norm.ppf(1 - np.power(0.1, phi))
+    expected_interval = np.where(count == 0, delta_i, np.where(count == 1, mean, mean + z * std))
+    return np.asarray(enviornment) + expected_interval
 
-        expected_arrival_time = arrival_time + interval_list
+
+def accural_estimate_for_n_array(enviornment, delta_i, n_array, phi, stats=None):
+    if stats is None:
+        stats = WindowStats(enviornment)
+    mistake_duration = np.zeros(len(n_array), dtype=float)
+    for part, n in stats.n_blocks(n_array):
+        expected_arrival_time = accural_expected_arrival_time(enviornment, delta_i, n, phi, stats)
+        mistake_duration[part] = qos_from_expected(enviornment, expected_arrival_time)[0]
     return mistake_duration
 
 
+def accural_estimate_grid(enviornment, delta_i, n, phi, stats=None):
+    """
+    This function is used to evaluate the accrual FD on the Cartesian product of n and phi. The window statistics are
+    built once, and every n needs one closed-form phi sweep (see accural_sweep_phi).
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int or np.array): values of n
+        phi (float or np.array): values of phi
+        stats (WindowStats): window statistics of enviornment, built if not given
+
+    Returns:
+        pd.DataFrame: indexed by (n, phi), with the columns mistake_duration, wrong_count, pa and detection_time
+    """
+    if stats is None:
+        stats = WindowStats(enviornment)
+    index, _ = parameter_grid({'n': n, 'phi': phi})
+    # the raw axes, not index.levels: the levels are sorted and without repeats, the index is neither
+    n_values, phi_values = np.atleast_1d(n), np.atleast_1d(np.asarray(phi, dtype=float))
+    shape = (len(n_values), len(phi_values))
+    mistake_duration, wrong_count, pa, detection_time = np.zeros(shape), np.zeros(shape, dtype=np.int64), \
+        np.zeros(shape), np.zeros(shape)
+    z = st.norm.ppf(1 - np.power(0.1, phi_values))
+    for row, n_value in enumerate(n_values):
+        mistake_duration[row], wrong_count[row], pa[row] = accural_sweep_phi(enviornment, delta_i, n_value,
+                                                                             phi_values, stats)
+        # the detection time is the last expected interval
+        count, mean, std = stats.difference_statistics(n_value, stats.length - 1)
+        detection_time[row] = delta_i if count == 0 else mean if count == 1 else mean + z * std
+    return grid_frame(index, mistake_duration=mistake_duration, wrong_count=wrong_count, pa=pa,
+                      detection_time=detection_time)
+
+
 def accural_estimate(enviornment, delta_i, n, phi):
     if type(n) != np.ndarray and type(n) != int:
         raise TypeError('The data type of n can only be numpy array or int')
@@ -118,9 +198,9 @@ def accural_estimate(enviornment, delta_i, n, phi):
         raise TypeError('The data type of alpha can only be numpy array or int')
 
     if type(n) == np.ndarray and type(phi) == np.ndarray:
-        raise TypeError('The data type of n and alpha cannot be both array')
+        mistake_duration = accural_estimate_grid(enviornment, delta_i, n, phi)
     elif type(phi) == np.ndarray:
-        mistake_duration = accural_estimate_for_phi_array(enviornment, delta_i, n, phi)
+        mistake_duration, wrong_count, pa = accural_sweep_phi(enviornment, delta_i, n, phi)
     elif type(n) == np.ndarray:
         mistake_duration = accural_estimate_for_n_array(enviornment, delta_i, n, phi)
     else:
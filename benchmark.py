@@ -1,3 +1,20 @@
+import numpy as np
+import pandas as pd
+
+METRIC_NAMES = ("detection time", "detection time std", "pa", "pa std", "mistake duration", "CPU time",
+                "memory usage")
+# the memory is not weighted by default: it is the size of the Record of the FD (see run.detector_memory), the same
+# for every FD with the same window, so its share goes to the CPU time
+DEFAULT_WEIGHTS = (0.2, 0.15, 0.2, 0.15, 0.1, 0.2, 0.0)
+# (value scored MAX_SCORE, value scored MIN_SCORE) of every metric, in the order of METRIC_NAMES. The CPU time (s) is
+# per detector run, so its range is calibrated on pairs of 100000 heartbeats, the length of the traces of data; the
+# memory (MB) is the peak allocation of the detector, about 0.045 MB for the shipped FDs
+DEFAULT_RANGES = ((99.98, 105.75), (0.32, 2.39), (0.9979, 0.6833), (0.0008, 0.0841), (9337.38, 2356274.1),
+                  (0.3, 0.6), (0.045, 0.06))
+MAX_SCORE = 90
+MIN_SCORE = 60
+
+
 def gen_linear(max_value, min_value, max_score, min_score):
     slope = (max_score - min_score) / (max_value - min_value)
     intersect = max_score - slope * max_value
@@ -9,32 +26,99 @@ def gen_linear(max_value, min_value, max_score, min_score):
     return linear
 
 
-def calc_score(metric_data, weights=(0.2, 0.15, 0.2, 0.15, 0.1, 0.1, 0.1)):
-    mistake_duration_func = gen_linear(9337.38, 2356274.1, 90, 60)
-    detection_time_func = gen_linear(99.98, 105.75, 90, 60)
-    pa_func = gen_linear(0.9979, 0.6833, 90, 60)
-    cpu_time_func = gen_linear(0.33, 0.53, 90, 60)
-    memory_func = gen_linear(84.63, 113.12, 90, 60)
-    detection_time_std_func = gen_linear(0.32, 2.39, 90, 60)
-    pa_std_func = gen_linear(0.0008, 0.0841, 90, 60)
+def score_matrix(metric_data, ranges=DEFAULT_RANGES, max_score=MAX_SCORE, min_score=MIN_SCORE):
+    """
+    This function is used to score the metrics of any number of FDs at once, with the linear mapping of gen_linear
+    applied to whole columns.
+
+    Args:
+        metric_data (array like): (number of FDs, 7) metrics, in the order of METRIC_NAMES
+        ranges (array like): (7, 2) values scored max_score and min_score for every metric
+        max_score (float): score of the first value of a range
+        min_score (float): score of the second value of a range
 
-    funcs = (detection_time_func, detection_time_std_func, pa_func, pa_std_func, mistake_duration_func,
-             cpu_time_func, memory_func)
+    Returns:
+        np.array: (number of FDs, 7) unweighted scores, between 0 and 100
+    """
+    ranges = np.asarray(ranges, dtype=float)
+    slope = (max_score - min_score) / (ranges[:, 0] - ranges[:, 1])
+    intersect = max_score - slope * ranges[:, 0]
+    scores = np.clip(slope * np.asarray(metric_data, dtype=float) + intersect, 0, 100)
+    scores[np.isnan(scores)] = 100  # as gen_linear, whose comparisons are all False for nan
+    return scores
 
-    names = ("detection time", "detection time std", "pa", "pa std", "mistake duration", "CPU time", "memory usage")
 
-    scores = {}
+def _score_dict(scores, weights):
+    # the rounding of every term is part of the published scores, so it stays in Python floats
+    score_dict = {}
     total_score = 0
-    for i in range(len(metric_data)):
-        unweighted_score = funcs[i](metric_data[i])
-        scores[names[i]] = float(f"{round(unweighted_score, 1):.1f}")
-        total_score += round(unweighted_score * weights[i], 1)
-    total_score = float(f"{total_score:.1f}")
-    scores["total"] = total_score
-    return scores
+    for name, score, weight in zip(METRIC_NAMES, scores.tolist(), weights):
+        score_dict[name] = float(f"{round(score, 1):.1f}")
+        total_score += round(score * weight, 1)
+    score_dict["total"] = float(f"{total_score:.1f}")
+    return score_dict
+
+
+def score_table(metrics, weights=DEFAULT_WEIGHTS, ranges=DEFAULT_RANGES):
+    """
+    This function is used to score several FDs from their raw metrics, e.g. again with other weights or ranges.
+
+    Args:
+        metrics (dict): {FD name: (detection time, detection time std, pa, pa std, mistake duration, cpu, memory)}
+        weights (tuple): weight of every metric in the total, in the order of METRIC_NAMES
+        ranges (array like): (7, 2) values scored MAX_SCORE and MIN_SCORE for every metric
+
+    Returns:
+        dict: {FD name: {metric name: score, "total": weighted score}}, the input of the visualization
+    """
+    if not metrics:
+        return {}
+    scores = score_matrix(list(metrics.values()), ranges)
+    return {fd: _score_dict(row, weights) for fd, row in zip(metrics, scores)}
+
+
+def calc_score(metric_data, weights=DEFAULT_WEIGHTS, ranges=DEFAULT_RANGES):
+    return _score_dict(score_matrix([metric_data], ranges)[0], weights)
+
+
+def rank_stability(metrics, samples=10000, weights=DEFAULT_WEIGHTS, concentration=None, ranges=DEFAULT_RANGES,
+                   seed=None):
+    """
+    This function is used to measure how much the ranking of FDs depends on the weights: weight vectors are drawn from a
+    Dirichlet distribution, flat (every weighting equally likely) or centered on weights, and the FDs are ranked by
+    their total score under each of them, all samples at once.
+
+    Args:
+        metrics (dict): {FD name: (detection time, detection time std, pa, pa std, mistake duration, cpu, memory)}
+        samples (int): number of weight vectors drawn
+        weights (tuple): center of the distribution when concentration is given, and the reference ranking
+        concentration (float): the Dirichlet parameters are concentration * weights, the larger the closer the samples
+        are to weights; None draws from the flat Dirichlet distribution
+        ranges (array like): (7, 2) values scored MAX_SCORE and MIN_SCORE for every metric
+        seed (int): seed of the random generator
+
+    Returns:
+        pd.DataFrame: one row per FD, best first under weights: the probability of every rank ('rank 1' ...), the mean
+        rank and the probability of keeping its rank under weights ('stable')
+    """
+    names = list(metrics)
+    scores = score_matrix([metrics[fd] for fd in names], ranges)
+    rng = np.random.default_rng(seed)
+    alpha = np.ones(len(METRIC_NAMES)) if concentration is None else concentration * np.asarray(weights, dtype=float)
+    sampled = rng.dirichlet(alpha, samples)
+    totals = sampled @ scores.T  # (samples, number of FDs)
+    # rank 0 is the best, ties broken in favor of the first FD, as a stable sort would
+    ranks = np.argsort(np.argsort(-totals, axis=1, kind='stable'), axis=1, kind='stable')
+    reference = np.argsort(np.argsort(-(scores @ np.asarray(weights, dtype=float)), kind='stable'), kind='stable')
+    counts = np.bincount((ranks * len(names) + np.arange(len(names))).ravel(), minlength=len(names) ** 2)
+    probability = counts.reshape(len(names), len(names)).T / samples  # (FD, rank)
+    df = pd.DataFrame(probability, index=names, columns=['rank {}'.format(r + 1) for r in range(len(names))])
+    df['mean rank'] = ranks.mean(axis=0) + 1
+    df['stable'] = (ranks == reference).mean(axis=0)
+    return df.iloc[np.argsort(reference, kind='stable')]
 
 
-def feed_to_visual(algo_name, metric_data, visual_data=None, weights=(0.2, 0.15, 0.2, 0.15, 0.1, 0.1, 0.1)):
+def feed_to_visual(algo_name, metric_data, visual_data=None, weights=DEFAULT_WEIGHTS):
     # visual data is the argument you can directly pass into the functions in visualization.py
     if visual_data is None:
         visual_data = {}
@@ -44,13 +128,14 @@ def feed_to_visual(algo_name, metric_data, visual_data=None, weights=(0.2, 0.15,
 
 if __name__ == '__main__':
     accural_data = (105.74858808928572, 1.6750364820071866, 0.9979379611895526, 0.0008348593499185055,
-                    9364.899149998326, 0.6029575892857143, 110.89264787946429)
+                    9364.899149998326, 0.5924918654, 0.0449411773)
     bertier_data = (100.91581011049107, 1.059675334140229, 0.9112516167575638, 0.02535474631119393, 644043.3404513125,
-                    0.375, 82.63825334821429)
+                    0.4372791235, 0.0448862712)
     chen_data = (100.09092747600445, 0.9009301070789003, 0.7423359876953095, 0.08329813139516726,
-                 2353438.4988998906, 0.294921875, 82.54171316964286)
+                 2353438.4988998906, 0.3027926378, 0.0449030558)
     visual_input = {}
     feed_to_visual("accural", accural_data, visual_input)
     feed_to_visual("bertier", bertier_data, visual_input)
     feed_to_visual("chen", chen_data, visual_input)
     print(visual_input)
+    print(rank_stability({"accural": accural_data, "bertier": bertier_data, "chen": chen_data}, seed=0))
@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
 from Extension.record import Record
+from window_stats import WindowStats
+from grid_sweep import parameter_grid, grid_frame
 import matplotlib.pyplot as plt
 import os
 import psutil
@@ -78,18 +80,15 @@ def bertier_estimate_for_parameter_array(enviornment, delta_i, n, delay, var, ga
     return mistake_duration
 
 
-def bertier_estimate_for_n_array(enviornment, delta_i, n_array, delay, var, gamma, beta, phi):
+def bertier_estimate_for_n_array(enviornment, delta_i, n_array, delay, var, gamma, beta, phi, stats=None):
+    if stats is None:
+        stats = WindowStats(enviornment)
     length = len(n_array)
     mistake_duration = np.zeros(length, dtype=float)
     expected_arrival_time = np.array([enviornment[0] for i in range(length)])
-    record_list = [Record(i) for i in n_array]
-    current_length = np.zeros(length)
-    current_sum = np.zeros(length, dtype=float)
-    for arrival_time in enviornment:
-        for inx, record in enumerate(record_list):
-            record.append(arrival_time)
-            current_length[inx] = record.get_length()
-            current_sum[inx] = record.get_sum()
+    for inx, arrival_time in enumerate(enviornment):
+        # window length and mean of every Record(n) after this arrival time, in O(1) per n
+        current_length, current_mean = stats.arrival_window(n_array, inx)
 
         duration = -expected_arrival_time + arrival_time
         duration = np.maximum(duration, 0)
@@ -100,12 +99,114 @@ def bertier_estimate_for_n_array(enviornment, delta_i, n_array, delay, var, gamm
         var = var + gamma * (np.abs(error) - var)
         alpha = beta * delay + phi * var
 
-        expected_arrival_time = alpha + current_sum / current_length + (
-                (current_length + 1) / 2) * delta_i
+        expected_arrival_time = alpha + current_mean + ((current_length + 1) / 2) * delta_i
 
     return mistake_duration
 
 
+def bertier_estimate_batch(enviornment_list, delta_i, n, delay, var, gamma, beta=1, phi=4):
+    """
+    This function is used to run Bertier's FD on many traces (e.g. all the pairs of a traces folder) in lockstep. The
+    recurrence of delay, var and alpha is sequential in time, but the traces are independent, so the traces are
+    aligned into a (number of traces, longest length) array and every timestep updates the state of all of them as one
+    numpy vector; traces that already ended are masked out. The parameters may also be 1-D arrays of the same length
+    K (one configuration per element), then the state has shape (number of traces, K) and every configuration is
+    evaluated in the same pass. The window means come from the prefix sums of WindowStats, and the arrival times are
+    taken relative to the first one of each trace to keep float64 exact.
+
+    Args:
+        enviornment_list (list): arrival times of the heartbeats of every trace
+        delta_i (float): sending interval of the heartbeats
+        n (int or np.array): size of the window
+        delay (float or np.array): initial delay
+        var (float or np.array): initial var
+        gamma (float or np.array): gain of the estimators
+        beta (float or np.array): weight of the delay in alpha
+        phi (float or np.array): weight of the var in alpha
+
+    Returns:
+        tuple: (mistake_duration, detection_time, pa, wrong_count), each an np.array of shape (number of traces,) if all
+        the parameters are scalars, (number of traces, K) otherwise
+    """
+    parameters = [np.asarray(p, dtype=np.float64) for p in (n, delay, var, gamma, beta, phi)]
+    scalar = all(p.ndim == 0 for p in parameters)
+    n, delay, var, gamma, beta, phi = [np.atleast_1d(p)[None, :] for p in parameters]
+    n = n.astype(np.int64)
+
+    count = len(enviornment_list)
+    lengths = np.array([len(e) for e in enviornment_list])
+    longest = int(np.max(lengths))
+    arrivals = np.zeros((count, longest))
+    prefix = np.zeros((count, longest + 1))
+    step = np.zeros((count, 1))
+    for p, enviornment in enumerate(enviornment_list):
+        stats = WindowStats(enviornment)
+        arrivals[p, :lengths[p]] = (np.asarray(enviornment) - stats.origin).astype(np.float64)
+        prefix[p, :lengths[p] + 1] = stats.arrival_prefix
+        prefix[p, lengths[p] + 1:] = stats.arrival_prefix[-1]
+        step[p] = stats.step
+    rows = np.arange(count)[:, None]
+    lengths = lengths[:, None]
+
+    shape = np.broadcast(arrivals[:, :1], n, delay, var, gamma, beta, phi).shape
+    mistake_duration = np.zeros(shape)
+    wrong_count = np.zeros(shape, dtype=np.int64)
+    expected_arrival_time = np.zeros(shape)  # relative to the first arrival time of every trace
+    delay = np.broadcast_to(delay, shape).copy()
+    var = np.broadcast_to(var, shape).copy()
+    for t in range(longest):
+        active = t < lengths
+        arrival_time = arrivals[:, t:t + 1]
+
+        late = active & (arrival_time > expected_arrival_time)
+        mistake_duration += np.where(late, arrival_time - expected_arrival_time, 0.0)
+        wrong_count += late
+
+        # calculating the value of alpha
+        error = arrival_time - expected_arrival_time - delay
+        new_delay = delay + gamma * error
+        new_var = var + gamma * (np.abs(error) - var)
+        alpha = beta * new_delay + phi * new_var
+
+        # calculating the next expected arrival time from the window of every trace
+        current_length = np.minimum(t + 1, n)
+        first = t + 1 - current_length
+        current_mean = step * (first + t) / 2 + (prefix[:, t + 1:t + 2] - prefix[rows, first]) / current_length
+        new_expected_arrival_time = alpha + current_mean + ((current_length + 1) / 2) * delta_i
+
+        delay = np.where(active, new_delay, delay)
+        var = np.where(active, new_var, var)
+        expected_arrival_time = np.where(active, new_expected_arrival_time, expected_arrival_time)
+
+    detection_time = expected_arrival_time - arrivals[rows, lengths - 1]
+    pa = (lengths - wrong_count) / lengths
+    if scalar:
+        return mistake_duration[:, 0], detection_time[:, 0], pa[:, 0], wrong_count[:, 0]
+    return mistake_duration, detection_time, pa, wrong_count
+
+
+def bertier_estimate_grid(enviornment, delta_i, n, delay, var, gamma, beta=1, phi=4):
+    """
+    This function is used to evaluate Bertier's FD on the Cartesian product of any of its parameters. The grid is
+    flattened into one configuration axis and the whole product is evaluated in a single pass over the trace by
+    bertier_estimate_batch.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n, delay, var, gamma, beta, phi (scalar or np.array): values of every parameter
+
+    Returns:
+        pd.DataFrame: indexed by (n, delay, var, gamma, beta, phi), with the columns mistake_duration, wrong_count, pa
+        and detection_time
+    """
+    index, flat = parameter_grid({'n': n, 'delay': delay, 'var': var, 'gamma': gamma, 'beta': beta, 'phi': phi})
+    mistake_duration, detection_time, pa, wrong_count = bertier_estimate_batch(
+        [enviornment], delta_i, flat['n'], flat['delay'], flat['var'], flat['gamma'], flat['beta'], flat['phi'])
+    return grid_frame(index, mistake_duration=mistake_duration[0], wrong_count=wrong_count[0], pa=pa[0],
+                      detection_time=detection_time[0])
+
+
 def bertier_estimate(enviornment, delta_i, n, delay, var, gamma, beta=1, phi=4):
     parameter_dic = {'n': n, 'delay': delay, 'var': var, 'gamma': gamma, 'beta': beta, 'phi': phi}
     int_list = []
@@ -123,17 +224,18 @@ def bertier_estimate(enviornment, delta_i, n, delay, var, gamma, beta=1, phi=4):
 
     if len(array_list) == 0:
         # means there are no array-type parameters
-        return olivier_estimate_for_single_value(enviornment, delta_i, n, delay, var, gamma, beta, phi)
+        return bertier_estimate_for_single_value(enviornment, delta_i, n, delay, var, gamma, beta, phi)
     if len(array_list) == 1:
         # means there is one array-type parameter
         if array_list[0] == 'n':
             # means the array-type parameter is n
-            return olivier_estimate_for_n_array(enviornment, delta_i, n, delay, var, gamma, beta, phi)
+            return bertier_estimate_for_n_array(enviornment, delta_i, n, delay, var, gamma, beta, phi)
         else:
             # means the array-type parameter is not n
-            return olivier_estimate_for_parameter_array(enviornment, delta_i, n, delay, var, gamma, beta, phi)
+            return bertier_estimate_for_parameter_array(enviornment, delta_i, n, delay, var, gamma, beta, phi)
     else:
-        raise TypeError('There are more than one array in the parameters')
+        # means there are more than one array-type parameters, evaluate their Cartesian product
+        return bertier_estimate_grid(enviornment, delta_i, n, delay, var, gamma, beta, phi)
 
 
 if __name__ == '__main__':
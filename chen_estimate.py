@@ -1,6 +1,9 @@
 import pandas as pd
 import numpy as np
 from Extension.record import Record
+from qos import qos_from_expected
+from window_stats import WindowStats
+from grid_sweep import parameter_grid, grid_frame
 import matplotlib.pyplot as plt
 import os
 import psutil
@@ -38,6 +41,84 @@ def chen_estimate_for_single_value(enviornment, delta_i, n, alpha):
     return mistake_duration, detection_time, pa, cpu_time, memory
 
 
+def chen_expected_arrival_time(enviornment, delta_i, n, alpha, stats=None):
+    """
+    This function is used to calculate every next expected arrival time of Chen's FD at once, from the window means
+    given by WindowStats instead of a Record.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int or np.array): size of the window, an array of shape (m, 1) gives one row per window size
+        alpha (float): safety margin
+        stats (WindowStats): window statistics of enviornment, built if not given
+
+    Returns:
+        np.array: the next expected arrival time computed after each arrival time
+    """
+    if stats is None:
+        stats = WindowStats(enviornment)
+    length, mean = stats.arrival_window(n)
+    return alpha + mean + ((length + 1) / 2) * delta_i
+
+
+def chen_estimate_vectorized(enviornment, delta_i, n, alpha):
+    """
+    This function gives the same results as chen_estimate_for_single_value (within float tolerance) without any
+    per-heartbeat Python loop.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int): size of the window
+        alpha (float): safety margin
+
+    Returns:
+        tuple: (mistake_duration, detection_time, pa, cpu_time, memory)
+    """
+    pid = os.getpid()
+
+    expected_arrival_time = chen_expected_arrival_time(enviornment, delta_i, n, alpha)
+    mistake_duration, wrong_count, pa, detection_time = qos_from_expected(enviornment, expected_arrival_time)
+    if detection_time < 0:
+        detection_time = 0
+    cpu_time = psutil.Process(pid).cpu_times().system
+    memory = psutil.Process(pid).memory_info().rss / 1024 / 1024
+
+    return mistake_duration, detection_time, pa, cpu_time, memory
+
+
+def chen_sweep_alpha(enviornment, delta_i, n, alpha_array, stats=None):
+    """
+    This function is used to evaluate Chen's FD for any number of alpha values at once. Alpha only shifts every
+    expected arrival time, so the arrival time k is late exactly when its slack (arrival time minus the expected arrival
+    time computed with alpha = 0) is larger than alpha, and the mistake duration is the sum of max(0, slack - alpha).
+    The slacks are computed and sorted once, then every alpha is answered by a binary search in the cumulative sums,
+    in O(T log T + A log T) in total.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n (int): size of the window
+        alpha_array (np.array): values of alpha to evaluate
+        stats (WindowStats): window statistics of enviornment, built if not given
+
+    Returns:
+        tuple: (mistake_duration, wrong_count, pa), each an np.array with the same length as alpha_array
+    """
+    alpha_array = np.asarray(alpha_array, dtype=float)
+    expected_arrival_time = chen_expected_arrival_time(enviornment, delta_i, n, 0, stats)
+    slack = np.sort(np.asarray(enviornment[1:], dtype=float) - expected_arrival_time[:-1])
+    # suffix_sum[i] is the sum of slack[i:]
+    suffix_sum = np.concatenate((np.cumsum(slack[::-1])[::-1], [0.0]))
+
+    position = np.searchsorted(slack, alpha_array, side='right')
+    wrong_count = len(slack) - position
+    mistake_duration = suffix_sum[position] - wrong_count * alpha_array
+    pa = (len(enviornment) - wrong_count) / len(enviornment)
+    return mistake_duration, wrong_count, pa
+
+
 def chen_estimate_for_alpha_array(enviornment, delta_i, n, alpha_list):
     mistake_duration = np.zeros(len(alpha_list), dtype=float)
     next_expected_arrival_time = np.array([float('inf') for i in range(len(alpha_list))])
@@ -57,26 +138,48 @@ def chen_estimate_for_alpha_array(enviornment, delta_i, n, alpha_list):
     return mistake_duration
 
 
-def chen_estimate_for_n_array(enviornment, delta_i, n_list, alpha):
+def chen_estimate_for_n_array(enviornment, delta_i, n_list, alpha, stats=None):
+    if stats is None:
+        stats = WindowStats(enviornment)
     mistake_duration = np.zeros(len(n_list), dtype=float)
-    next_expected_arrival_time = np.array([float('inf') for i in range(len(n_list))])
-    record_list = [Record(i) for i in n_list]
-    current_length = np.zeros(len(n_list))
-    current_sum = np.zeros(len(n_list), dtype=float)
-    for arrival_time in enviornment:
-        for inx, record in enumerate(record_list):
-            record.append(arrival_time)
-            current_length[inx] = record.get_length()
-            current_sum[inx] = record.get_sum()
+    for part, n in stats.n_blocks(n_list):
+        expected_arrival_time = chen_expected_arrival_time(enviornment, delta_i, n, alpha, stats)
+        mistake_duration[part] = qos_from_expected(enviornment, expected_arrival_time)[0]
 
-        duration = -next_expected_arrival_time + arrival_time
-        duration = np.maximum(duration, 0)
-        mistake_duration += duration
+    return mistake_duration
 
-        next_expected_arrival_time = alpha + current_sum / current_length + (
-                (current_length + 1) / 2) * delta_i
 
-    return mistake_duration
+def chen_estimate_grid(enviornment, delta_i, n_list, alpha_list, stats=None):
+    """
+    This function is used to evaluate Chen's FD on the Cartesian product of n and alpha. The window statistics are
+    built once, and every n needs one closed-form alpha sweep (see chen_sweep_alpha).
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        delta_i (float): sending interval of the heartbeats
+        n_list (int or np.array): values of n
+        alpha_list (float or np.array): values of alpha
+        stats (WindowStats): window statistics of enviornment, built if not given
+
+    Returns:
+        pd.DataFrame: indexed by (n, alpha), with the columns mistake_duration, wrong_count, pa and detection_time
+    """
+    if stats is None:
+        stats = WindowStats(enviornment)
+    index, _ = parameter_grid({'n': n_list, 'alpha': alpha_list})
+    # the raw axes, not index.levels: the levels are sorted and without repeats, the index is neither
+    n_values, alpha_values = np.atleast_1d(n_list), np.atleast_1d(np.asarray(alpha_list, dtype=float))
+    shape = (len(n_values), len(alpha_values))
+    mistake_duration, wrong_count, pa, detection_time = np.zeros(shape), np.zeros(shape, dtype=np.int64), \
+        np.zeros(shape), np.zeros(shape)
+    for row, n in enumerate(n_values):
+        mistake_duration[row], wrong_count[row], pa[row] = chen_sweep_alpha(enviornment, delta_i, n, alpha_values,
+                                                                            stats)
+        length, mean = stats.arrival_window(n, stats.length - 1)
+        last_expected_arrival_time = mean + ((length + 1) / 2) * delta_i
+        detection_time[row] = np.maximum(last_expected_arrival_time + alpha_values - enviornment[-1], 0)
+    return grid_frame(index, mistake_duration=mistake_duration, wrong_count=wrong_count, pa=pa,
+                      detection_time=detection_time)
 
 
 def chen_estimate(enviornment, delta_i, n_list, alpha_list):
@@ -86,15 +189,15 @@ def chen_estimate(enviornment, delta_i, n_list, alpha_list):
         raise TypeError('The data type of alpha can only be numpy array or int')
 
     if type(n_list) == np.ndarray and type(alpha_list) == np.ndarray:
-        raise TypeError('The data type of n and alpha cannot be both array')
+        return chen_estimate_grid(enviornment, delta_i, n_list, alpha_list)
     elif type(alpha_list) == np.ndarray:
-        mistake_duration = chen_estimate_for_alpha_array(enviornment, delta_i, n_list, alpha_list)
+        mistake_duration, wrong_count, pa = chen_sweep_alpha(enviornment, delta_i, n_list, alpha_list)
         return mistake_duration
     elif type(n_list) == np.ndarray:
         mistake_duration = chen_estimate_for_n_array(enviornment, delta_i, n_list, alpha_list)
         return mistake_duration
     else:
-        mistake_duration = chen_estimate_for_single_value(enviornment, delta_i, n_list, alpha_list)
+        mistake_duration = chen_estimate_vectorized(enviornment, delta_i, n_list, alpha_list)
         return mistake_duration
 
 
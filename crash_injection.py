@@ -0,0 +1,199 @@
+import argparse
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from run import DELTA, list_nodes, load_detector, pair_schedule
+from running_stats import QuantileSketch
+from trace_store import open_array, pair_handle
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def crash_points(length, points, rng, warmup=0):
+    """
+    This function is used to choose the simulated crash instants of a trace: a crash at index k means that the arrival
+    time k is the last heartbeat received from the sender.
+
+    Args:
+        length (int): number of arrival times of the trace
+        points (int): number of crash instants, all the eligible indexes if the trace is shorter
+        rng (np.random.Generator): random generator
+        warmup (int): number of first arrival times that cannot be crash instants, e.g. while the window fills up
+
+    Returns:
+        np.array: sorted indexes into the trace
+    """
+    eligible = max(0, length - warmup)
+    if eligible <= points:
+        return np.arange(warmup, length)
+    return np.sort(rng.choice(eligible, points, replace=False)) + warmup
+
+
+def detection_times(enviornment, expected_arrival_time, index):
+    """
+    This function is used to get the detection time of crashes at many instants at once. After a crash right after the
+    arrival time k, no heartbeat arrives anymore, so the FD suspects the sender at the next expected arrival time it
+    computed after the arrival time k: the detection time is expected_arrival_time[k] - enviornment[k] (0 if the
+    expected arrival time was already past), the same definition as run.run uses for the end of the trace.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        expected_arrival_time (np.array): expected_arrival_time[..., k] is the next expected arrival time computed
+        right after the arrival time k, as in qos.qos_from_expected
+        index (np.array): crash instants, indexes into enviornment
+
+    Returns:
+        np.array: detection times in ns, with the leading axes of expected_arrival_time and one value per crash instant
+    """
+    arrival_time = np.asarray(enviornment[index], dtype=np.float64)
+    return np.maximum(expected_arrival_time[..., index] - arrival_time, 0.0)
+
+
+def percentiles(times):
+    """
+    This function is used to summarize detection times.
+
+    Args:
+        times (np.array): detection times in ns
+
+    Returns:
+        dict: {'p50': ..., 'p90': ..., 'p99': ..., 'p99.9': ..., 'mean': ...} in ms, empty if there is no value
+    """
+    if len(times) == 0:
+        return {}
+    summary = {'p{:g}'.format(p): v / 1e6 for p, v in zip(PERCENTILES, np.percentile(times, PERCENTILES))}
+    summary['mean'] = float(np.mean(times)) / 1e6
+    return summary
+
+
+def inject_crashes(enviornment, language_file, record_class, extension_dir='Extension', points=1000, rng=None,
+                   warmup=0):
+    """
+    This function is used to measure the detection time distribution of an FD on one trace: the FD runs once over the
+    trace (see run.translate_function, 'expected_arrivals') and every crash instant is read from its series of expected
+    arrival times, instead of running the FD again up to every crash.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+        points (int): number of crash instants
+        rng (np.random.Generator): random generator of the crash instants
+        warmup (int): number of first arrival times that cannot be crash instants
+
+    Returns:
+        tuple: (crash instants, detection times in ns)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    index = crash_points(len(enviornment), points, rng, warmup)
+    if len(index) == 0:
+        return index, np.array([], dtype=np.float64)
+    expected_arrival_time = load_detector(language_file, record_class, extension_dir, 'expected_arrivals')(
+        enviornment, DELTA)
+    return index, detection_times(enviornment, expected_arrival_time, index)
+
+
+def crash_task(task):
+    """
+    This function is used to inject crashes into one (receiver, sender) pair in a pool worker.
+
+    Args:
+        task (tuple): (language file, record class, extension folder, receiver folder, sender folder, ArrayHandle,
+        number of crash instants, seed, warmup)
+
+    Returns:
+        tuple: (language file, (receiver folder, sender folder), detection times in ns)
+    """
+    language_file, record_class, extension_dir, i, j, handle, points, seed, warmup = task
+    rng = np.random.default_rng([seed, int(i[4:]), int(j[4:])])
+    _, times = inject_crashes(open_array(handle), language_file, record_class, extension_dir, points, rng, warmup)
+    return language_file, (i, j), times
+
+
+def run_crash_injection(failure_detectors, data_file, processes=32, extension_dir='Extension', points=1000, seed=0,
+                        warmup=0, keep_times=False, on_pair=None):
+    """
+    This function is used to measure the detection time distribution of several FDs over every (receiver, sender) pair
+    of a traces folder, one pool task per (FD, pair), longest trace first like run.run_many. The distribution of an FD
+    over all its pairs is kept in a QuantileSketch, so only the per-pair summaries grow with the number of pairs,
+    unless keep_times asks for every detection time.
+
+    Args:
+        failure_detectors (dict): {language file (without '.txt'): record class (without '.py')}
+        data_file (str): path to the traces folder
+        processes (int): number of processes of the pool
+        extension_dir (str): path to the Extension folder
+        points (int): number of crash instants per pair
+        seed (int): seed of the crash instants, the same seed gives the same instants for a pair
+        warmup (int): number of first arrival times of every pair that cannot be crash instants
+        keep_times (bool): whether to also return the detection times of every pair
+        on_pair (function): called as on_pair(language file, (receiver folder, sender folder), detection times in ns)
+        as soon as a pair is done
+
+    Returns:
+        dict: {language file: {'pairs': {(receiver folder, sender folder): percentiles}, 'sketch': QuantileSketch of
+        the detection times in ms, 'times': {(receiver folder, sender folder): detection times in ns} if keep_times}}
+    """
+    # compile before forking so that workers inherit the detectors (or find them in the on-disk cache)
+    for language_file, record_class in failure_detectors.items():
+        load_detector(language_file, record_class, extension_dir)
+    directories = list_nodes(data_file)
+    lengths, receivers, senders = pair_schedule(data_file, directories)
+    results = {language_file: {'pairs': {}, 'sketch': QuantileSketch()} for language_file in failure_detectors}
+    if keep_times:
+        for result in results.values():
+            result['times'] = {}
+
+    def tasks():
+        fds = list(failure_detectors.items())
+        for index in np.argsort(-np.tile(lengths, len(fds)), kind='stable'):
+            language_file, record_class = fds[index // len(lengths)]
+            i, j = directories[receivers[index % len(lengths)]], directories[senders[index % len(lengths)]]
+            handle = pair_handle(os.path.join(data_file, i), int(j[4:]))
+            yield language_file, record_class, extension_dir, i, j, handle, points, seed, warmup
+
+    with multiprocessing.Pool(processes=processes) as pool:
+        for language_file, pair, times in pool.imap_unordered(crash_task, tasks()):
+            result = results[language_file]
+            result['pairs'][pair] = percentiles(times)
+            result['sketch'].add_array(times / 1e6)
+            if keep_times:
+                result['times'][pair] = times
+            if on_pair is not None:
+                on_pair(language_file, pair, times)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    cwd = os.getcwd()
+    parser.add_argument("-t", default=os.path.join(cwd, "data"), help="Directory to traces folder")
+    parser.add_argument("-E", default=os.path.join(cwd, "Extension"), help="Directory to Extension folder")
+    parser.add_argument("-l", "--lang", action="append", required=True, help="Language file, can be repeated")
+    parser.add_argument("-r", "--rec", action="append", help="Record class of every language file (record by default)")
+    parser.add_argument("-p", type=int, default=32, help="Number of processes")
+    parser.add_argument("--points", type=int, default=1000, help="Number of crash instants per pair")
+    parser.add_argument("--warmup", type=int, default=0, help="Number of first heartbeats that are never crash instants")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the crash instants")
+    parser.add_argument("--pairs", action="store_true", help="Also print the percentiles of every pair")
+    args = parser.parse_args()
+
+    records = args.rec or ['record'] * len(args.lang)
+    if len(records) != len(args.lang):
+        parser.error('give one -r per -l, or none')
+    fds = dict(zip(args.lang, records))
+    injected = run_crash_injection(fds, args.t, args.p, args.E, args.points, args.seed, args.warmup)
+    # one JSON line per FD, then one per pair with --pairs
+    for language, result in injected.items():
+        sketch = result['sketch']
+        summary = {'p{:g}'.format(p): sketch.quantile(p / 100) for p in PERCENTILES}
+        print(json.dumps({'fd': language, 'pairs': len(result['pairs']), 'crashes': sketch.count,
+                          'detection_time_ms': summary}))
+    if args.pairs:
+        for language, result in injected.items():
+            for (i, j), summary in sorted(result['pairs'].items()):
+                print(json.dumps({'fd': language, 'receiver': i, 'sender': j, 'detection_time_ms': summary}))
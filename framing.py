@@ -0,0 +1,67 @@
+import pickle
+import struct
+
+HEADER = struct.Struct('>I')  # length of the pickled payload that follows
+
+
+def write_frame(stream, record):
+    """
+    This function is used to write one record to a binary stream as a length-prefixed pickle and flush it, so that
+    the reader at the other end of a pipe receives it immediately.
+
+    Args:
+        stream: binary file object (e.g. sys.stdout.buffer)
+        record (object): picklable record
+
+    Returns:
+        None
+    """
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    """
+    This function is used to read one record written by write_frame.
+
+    Args:
+        stream: binary file object
+
+    Returns:
+        object: the record, None at the end of the stream (or if the last frame is truncated)
+    """
+    header = _read_exact(stream, HEADER.size)
+    if header is None:
+        return None
+    payload = _read_exact(stream, HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return pickle.loads(payload)
+
+
+def read_frames(stream):
+    """
+    This function is used to iterate over the records of a stream until it ends.
+
+    Args:
+        stream: binary file object
+
+    Returns:
+        generator: the records
+    """
+    while True:
+        record = read_frame(stream)
+        if record is None:
+            return
+        yield record
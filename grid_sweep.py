@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+
+def parameter_grid(axes):
+    """
+    This function is used to build the Cartesian product of several parameter axes.
+
+    Args:
+        axes (dict): {parameter name: scalar or 1-D np.array of values}, in the order of the axes of the grid
+
+    Returns:
+        tuple: (pd.MultiIndex of the product, {parameter name: flattened np.array with one element per grid point})
+    """
+    names = list(axes.keys())
+    values = [np.atleast_1d(np.asarray(v)) for v in axes.values()]
+    index = pd.MultiIndex.from_product(values, names=names)
+    mesh = np.meshgrid(*values, indexing='ij')
+    return index, {name: m.ravel() for name, m in zip(names, mesh)}
+
+
+def grid_frame(index, **columns):
+    """
+    This function is used to label the results of a grid sweep.
+
+    Args:
+        index (pd.MultiIndex): the product returned by parameter_grid
+        **columns (np.array): one array per metric, whose C-order flattening follows the index
+
+    Returns:
+        pd.DataFrame: one row per grid point and one column per metric
+    """
+    return pd.DataFrame({name: np.ravel(column) for name, column in columns.items()}, index=index)
@@ -0,0 +1,49 @@
+import itertools
+
+
+class HeartbeatStream:
+    """
+    This class is used to feed a detector the arrival times of a trace chunk by chunk, so that the trace never has to
+    be held in memory as a whole. Iterating over it yields every arrival time of every chunk in order, and it keeps
+    the only facts about the whole trace the detector loop needs: the first arrival time (known before the loop
+    starts), and the number of arrival times and the last one (complete once the loop is over).
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._head = next((chunk for chunk in self._chunks if len(chunk) > 0), None)
+        if self._head is None:
+            raise IndexError('the trace has no heartbeat')
+        self.first = self._head[0]
+        self.last = None
+        self.count = 0
+
+    def _counted_chunks(self):
+        chunk, self._head = self._head, None
+        while chunk is not None:
+            if len(chunk) > 0:
+                self.count += len(chunk)
+                self.last = chunk[-1]
+                yield chunk
+            chunk = next(self._chunks, None)
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._counted_chunks())
+
+
+def prefix_chunks(chunks, length):
+    """
+    This function is used to cut a stream of chunks after its first arrival times.
+
+    Args:
+        chunks (iterable): chunks of arrival times
+        length (int): number of arrival times to keep
+
+    Returns:
+        generator: the chunks, the last one truncated
+    """
+    for chunk in chunks:
+        if length <= 0:
+            return
+        yield chunk[:length]
+        length -= len(chunk)
@@ -0,0 +1,110 @@
+import argparse
+import multiprocessing
+import os
+import re
+
+from trace_store import LOG_BLOCK_ROWS, LOG_COLUMNS, STORE_DIR, ArrayWriter, ingest_trace_log, read_log, write_store
+
+LOG_PATTERN = re.compile(r'^(trace|sentinterval|sent)(\d+)\.log$')
+
+
+def ingest_table_log(log_path, node_path, kind, block_rows=LOG_BLOCK_ROWS):
+    """
+    This function is used to write a sentX.log or a sentintervalX.log as an int64 table in the binary store of node X,
+    which trace_store.load_table(node_path, kind) reads back.
+
+    Args:
+        log_path (str): path to the log file
+        node_path (str): path to the node directory
+        kind (str): 'sent' or 'sentinterval'
+        block_rows (int): number of lines parsed at once
+
+    Returns:
+        None
+    """
+    store_path = os.path.join(node_path, STORE_DIR)
+    os.makedirs(store_path, exist_ok=True)
+    writer = ArrayWriter(os.path.join(store_path, '{}.npy'.format(kind)), len(LOG_COLUMNS[kind]))
+    try:
+        for block in read_log(log_path, kind, block_rows):
+            writer.append(block)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def find_logs(dump_dir):
+    """
+    This function is used to list the raw logs of a PlanetLab dump.
+
+    Args:
+        dump_dir (str): path to the folder of the logs
+
+    Returns:
+        list: (path, kind, node number), largest file first
+    """
+    logs = []
+    for file_name in os.listdir(dump_dir):
+        match = LOG_PATTERN.match(file_name)
+        if match:
+            logs.append((os.path.join(dump_dir, file_name), match.group(1), int(match.group(2))))
+    logs.sort(key=lambda log: os.path.getsize(log[0]), reverse=True)
+    return logs
+
+
+def ingest_file(task):
+    """
+    This function is used to ingest one log in a pool worker.
+
+    Args:
+        task (tuple): (log path, kind, node number, traces folder, block rows)
+
+    Returns:
+        tuple: (log path, number of bytes ingested)
+    """
+    log_path, kind, node, data_file, block_rows = task
+    node_path = os.path.join(data_file, 'Node{}'.format(node))
+    if kind == 'trace':
+        ingest_trace_log(log_path, node_path, block_rows)
+    else:
+        ingest_table_log(log_path, node_path, kind, block_rows)
+    return log_path, os.path.getsize(log_path)
+
+
+def ingest(dump_dir, data_file, processes=None, block_rows=LOG_BLOCK_ROWS):
+    """
+    This function is used to turn a PlanetLab dump (traceX.log, sentX.log and sentintervalX.log files) into a traces
+    folder that run.run_all and run_benchmark.py can use directly, with one pool worker per log file.
+
+    Args:
+        dump_dir (str): path to the folder of the logs
+        data_file (str): path to the traces folder to write (it can be the dump folder itself)
+        processes (int): number of processes of the pool, os.cpu_count() by default
+        block_rows (int): number of lines parsed at once
+
+    Returns:
+        list: paths of the ingested logs
+    """
+    # the three logs of a node are written to different files of its store, so they can be ingested concurrently
+    logs = find_logs(dump_dir)
+    tasks = [(path, kind, node, data_file, block_rows) for path, kind, node in logs]
+    ingested = []
+    with multiprocessing.Pool(processes=processes) as pool:
+        for log_path, size in pool.imap_unordered(ingest_file, tasks):
+            ingested.append(log_path)
+            print('ingested {} ({:.1f} MB)'.format(log_path, size / 1024 / 1024), flush=True)
+    # a node with sent logs but no traceX.log received nothing, it still gets an empty store so that it is a receiver
+    # (and a sender) like the others
+    for node in {node for _, _, node in logs} - {node for _, kind, node in logs if kind == 'trace'}:
+        write_store(os.path.join(data_file, 'Node{}'.format(node)), {})
+    return ingested
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", required=True, help="Directory of the raw PlanetLab logs")
+    parser.add_argument("-o", default=os.path.join(os.getcwd(), "data"), help="Directory to traces folder to write")
+    parser.add_argument("-p", type=int, default=None, help="Number of processes")
+    args = parser.parse_args()
+    ingest(args.i, args.o, args.p)
@@ -0,0 +1,123 @@
+import os
+import pickle
+
+from framing import read_frame, write_frame
+
+
+class Journal:
+    """
+    This class is used to checkpoint a benchmark run: every finished (FD, receiver, sender) result is appended to an
+    on-disk file as one frame (see framing.py) and synced to disk, so that a run which is killed or preempted can be
+    resumed without running the finished tasks again. Every entry is stored under the result key of its FD (see
+    result_cache.result_key), so the entries of an FD whose language file, Record class, traces or parameters have
+    changed since are never reused.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def load(self):
+        """
+        This method is used to read back the entries of the journal. A frame truncated by a crash in the middle of a
+        write is dropped, and the file is cut just before it so that new entries can be appended after the last
+        complete one.
+
+        Args:
+            None
+
+        Returns:
+            dict: {result key: {(receiver folder, sender folder): tuple returned by run.run}}
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r+b') as f:
+            end = 0
+            while True:
+                try:
+                    record = read_frame(f)
+                except (EOFError, pickle.UnpicklingError):
+                    record = None
+                if record is None:
+                    break
+                entries.setdefault(record['key'], {})[record['pair']] = record['result']
+                end = f.tell()
+            f.truncate(end)
+        return entries
+
+    def compact(self, keys):
+        """
+        This method is used to drop the entries of the journal whose result key is not in keys, e.g. those of FDs that
+        are in the result cache since, or that have changed. The kept entries are written to a temporary file which
+        replaces the journal, so a crash in the middle leaves the old journal.
+
+        Args:
+            keys (set): result keys whose entries are kept
+
+        Returns:
+            None
+        """
+        if not os.path.exists(self.path):
+            return
+        tmp_path = self.path + '.tmp'
+        with open(self.path, 'rb') as f, open(tmp_path, 'wb') as out:
+            while True:
+                try:
+                    record = read_frame(f)
+                except (EOFError, pickle.UnpicklingError):
+                    record = None
+                if record is None:
+                    break
+                if record['key'] in keys:
+                    write_frame(out, record)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, self.path)
+
+    def open(self, resume=False, keep=None):
+        """
+        This method is used to open the journal for appending.
+
+        Args:
+            resume (bool): keep the existing entries, otherwise the journal is emptied
+            keep (set): when resuming, only the entries of these result keys are kept (see compact), all of them if
+            None
+
+        Returns:
+            Journal: self
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if resume and keep is not None:
+            self.compact(keep)
+        self._file = open(self.path, 'ab' if resume else 'wb')
+        return self
+
+    def append(self, key, pair, result):
+        """
+        This method is used to record one finished task. The entry is on disk when this method returns.
+
+        Args:
+            key (str): result key of the FD
+            pair (tuple): (receiver folder, sender folder)
+            result (tuple): tuple returned by run.run
+
+        Returns:
+            None
+        """
+        write_frame(self._file, {'key': key, 'pair': pair, 'result': result})
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
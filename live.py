@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import socket
+import struct
+import time
+from array import array
+
+import numpy as np
+
+from run import DELTA, load_detector
+
+HEARTBEAT = struct.Struct('>IIQ')  # peer id, sequence number, send time (time.monotonic_ns of the sender)
+STATUS_REQUEST = b'STATUS'
+PERCENTILES = (50, 90, 99, 99.9)
+RECEIVE_BUFFER = 1 << 24  # bytes, so that bursts of heartbeats are not dropped by the kernel
+
+
+class Peer:
+    """
+    This class is used to keep the state of the FD for one monitored peer: its monitor generator (see
+    run.translate_function), the next expected arrival time of its heartbeats and the timer that suspects it.
+    """
+
+    __slots__ = ('monitor', 'expected_arrival_time', 'timer', 'suspected', 'suspected_at', 'last_sent', 'heartbeats',
+                 'mistakes')
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        next(self.monitor)
+        self.expected_arrival_time = None
+        self.timer = None
+        self.suspected = False
+        self.suspected_at = None
+        self.last_sent = None
+        self.heartbeats = 0
+        self.mistakes = 0
+
+
+class FailureDetectorService(asyncio.DatagramProtocol):
+    """
+    This class is used to run an FD defined by a language file and a Record class as a live service: it receives
+    heartbeat datagrams (HEARTBEAT) from many peers over UDP, feeds each peer's arrival times to its own detector and
+    suspects a peer as soon as its next expected arrival time passes without a heartbeat. A datagram STATUS_REQUEST is
+    answered with the status of every peer as JSON.
+
+    Arrival times are time.monotonic_ns() values, so they are in ns like the traces, and a peer is suspected by a timer
+    of the event loop (whose clock is time.monotonic()) set at its next expected arrival time.
+    """
+
+    def __init__(self, language_file, record_class, extension_dir='Extension', delta=DELTA):
+        self.language_file = language_file
+        self.new_monitor = load_detector(language_file, record_class, extension_dir, 'monitor')
+        self.delta = delta
+        self.peers = {}
+        self.transport = None
+        self.received = 0
+        self.first_received = None
+        self.last_received = None
+        self.decision_latency = array('q')  # ns from the datagram being read to the decision being updated
+        self.end_to_end_latency = array('q')  # ns from the datagram being sent to the decision being updated
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+
+    def datagram_received(self, data, addr):
+        arrival_time = time.monotonic_ns()
+        if data == STATUS_REQUEST:
+            self.transport.sendto(json.dumps(self.status()).encode(), addr)
+            return
+        if len(data) != HEARTBEAT.size:
+            return
+        peer_id, sequence, sent = HEARTBEAT.unpack(data)
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            peer = self.peers[peer_id] = Peer(self.new_monitor(self.delta))
+        self.heartbeat(peer_id, peer, arrival_time, sent)
+
+        decided = time.monotonic_ns()
+        self.decision_latency.append(decided - arrival_time)
+        self.end_to_end_latency.append(decided - sent)
+        self.received += 1
+        if self.first_received is None:
+            self.first_received = arrival_time
+        self.last_received = decided
+
+    def heartbeat(self, peer_id, peer, arrival_time, sent):
+        """
+        This method is used to update the decision about a peer after one of its heartbeats arrived.
+
+        Args:
+            peer_id (int): id of the peer
+            peer (Peer): state of the peer
+            arrival_time (int): time.monotonic_ns() when the heartbeat was read
+            sent (int): time.monotonic_ns() of the peer when the heartbeat was sent
+
+        Returns:
+            None
+        """
+        if peer.timer is not None:
+            peer.timer.cancel()
+        if peer.suspected:
+            # the peer was alive after all
+            peer.suspected = False
+            peer.suspected_at = None
+            peer.mistakes += 1
+        peer.last_sent = sent
+        peer.heartbeats += 1
+        peer.expected_arrival_time = float(peer.monitor.send(arrival_time))
+        peer.timer = asyncio.get_running_loop().call_at(peer.expected_arrival_time / 1e9, self.suspect, peer)
+
+    def suspect(self, peer):
+        peer.timer = None
+        peer.suspected = True
+        peer.suspected_at = time.monotonic_ns()
+
+    def status(self):
+        """
+        This method is used to get the current decision about every peer.
+
+        Args:
+            None
+
+        Returns:
+            dict: {'peers': number of peers, 'suspected': ids of the suspected peers, 'received': number of heartbeats}
+        """
+        return {'peers': len(self.peers), 'suspected': sorted(i for i, peer in self.peers.items() if peer.suspected),
+                'received': self.received}
+
+    def report(self, crashed=()):
+        """
+        This method is used to summarize the performance of the service since it started.
+
+        Args:
+            crashed (iterable): ids of the peers known to have stopped sending, to measure their detection time
+
+        Returns:
+            dict: heartbeats per second, latency percentiles (ms), mistakes and detection times (ms)
+        """
+        crashed = set(crashed)
+        elapsed = (self.last_received - self.first_received) / 1e9 if self.received > 1 else float('nan')
+        detection_time = [peer.suspected_at - peer.last_sent for i, peer in self.peers.items()
+                          if i in crashed and peer.suspected]
+        return {'fd': self.language_file,
+                'peers': len(self.peers),
+                'received': self.received,
+                'heartbeats_per_second': self.received / elapsed if elapsed > 0 else float('nan'),
+                'decision_latency_ms': percentiles(self.decision_latency),
+                'end_to_end_latency_ms': percentiles(self.end_to_end_latency),
+                'mistakes': sum(peer.mistakes for i, peer in self.peers.items() if i not in crashed),
+                'crashed': len(crashed),
+                'detected': len(detection_time),
+                'detection_time_ms': percentiles(detection_time)}
+
+
+def percentiles(values_ns):
+    """
+    This function is used to summarize latencies.
+
+    Args:
+        values_ns (iterable): latencies in ns
+
+    Returns:
+        dict: {'p50': ..., 'p90': ..., 'p99': ..., 'p99.9': ...} in ms, empty if there is no value
+    """
+    values = np.frombuffer(values_ns, dtype=np.int64) if isinstance(values_ns, array) else np.asarray(values_ns)
+    if len(values) == 0:
+        return {}
+    return {'p{:g}'.format(p): v / 1e6 for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def generate_load(address, peers, interval, duration, crash=0.0, seed=0):
+    """
+    This function is the load generator: it sends the heartbeats of many simulated peers to a service from a single
+    socket, every peer once per interval with its own random phase, during the given duration. A fraction of the peers
+    crash, i.e. stop sending, at a random time in the middle half of the run.
+
+    Args:
+        address (tuple): (host, port) of the service
+        peers (int): number of simulated peers
+        interval (float): sending interval of every peer, in seconds
+        duration (float): length of the run, in seconds
+        crash (float): fraction of the peers that crash
+        seed (int): seed of the random phases and crashes
+
+    Returns:
+        dict: {'sent': number of heartbeats sent, 'crashed': ids of the crashed peers, 'late': number of heartbeats
+        sent late because the generator could not keep up}
+    """
+    rng = random.Random(seed)
+    phase = sorted((rng.random() * interval, i) for i in range(peers))
+    crashed = rng.sample(range(peers), int(round(crash * peers)))
+    crash_at = {i: duration * (0.25 + 0.5 * rng.random()) for i in crashed}
+    sequence = [0] * peers
+    sent = late = 0
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.monotonic()
+    for round_start in np.arange(0, duration, interval):
+        for offset, i in phase:
+            due = round_start + offset
+            if due >= duration:
+                break
+            if due >= crash_at.get(i, duration):
+                continue
+            wait = start + due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            elif wait < -interval:
+                late += 1
+            sock.sendto(HEARTBEAT.pack(i, sequence[i], time.monotonic_ns()), address)
+            sequence[i] += 1
+            sent += 1
+    sock.close()
+    return {'sent': sent, 'crashed': crashed, 'late': late}
+
+
+async def serve(language_file, record_class, extension_dir='Extension', host='127.0.0.1', port=9999,
+                print_interval=1.0):
+    """
+    This function is used to run the service until it is interrupted, printing the number of peers, of suspected peers
+    and the heartbeat rate periodically.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+        host (str): address to listen on
+        port (int): UDP port to listen on
+        print_interval (float): seconds between two status lines
+
+    Returns:
+        None
+    """
+    loop = asyncio.get_running_loop()
+    service = FailureDetectorService(language_file, record_class, extension_dir)
+    transport, _ = await loop.create_datagram_endpoint(lambda: service, local_addr=(host, port))
+    try:
+        received = 0
+        while True:
+            await asyncio.sleep(print_interval)
+            status = service.status()
+            print(f"peers: {status['peers']}, suspected: {len(status['suspected'])}, "
+                  f"heartbeats/s: {(service.received - received) / print_interval:.0f}", flush=True)
+            received = service.received
+    finally:
+        transport.close()
+
+
+async def benchmark(language_file, record_class, extension_dir='Extension', peers=1000, interval=0.1, duration=10.0,
+                    crash=0.01, seed=0, host='127.0.0.1'):
+    """
+    This function is used to measure whether an FD keeps up with live traffic: the service runs in this process and
+    the load generator in another one, on loopback.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+        peers (int): number of simulated peers
+        interval (float): sending interval of every peer, in seconds
+        duration (float): length of the run, in seconds
+        crash (float): fraction of the peers that crash during the run
+        seed (int): seed of the load generator
+        host (str): loopback address
+
+    Returns:
+        dict: the report of the service (see FailureDetectorService.report) with the load generator's counts
+    """
+    loop = asyncio.get_running_loop()
+    service = FailureDetectorService(language_file, record_class, extension_dir, delta=interval * 1e9)
+    transport, _ = await loop.create_datagram_endpoint(lambda: service, local_addr=(host, 0))
+    address = transport.get_extra_info('sockname')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+        load = await loop.run_in_executor(executor, generate_load, address, peers, interval, duration, crash, seed)
+    await asyncio.sleep(max(1.0, 10 * interval))  # let the last heartbeats and suspicions in
+    transport.close()
+    report = service.report(load['crashed'])
+    report.update({'sent': load['sent'], 'lost': load['sent'] - service.received, 'late_sends': load['late']})
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', choices=['serve', 'bench'], help='run the service, or benchmark it with simulated peers')
+    parser.add_argument('-l', '--lang', help='language file', required=True)
+    parser.add_argument('-r', '--rec', help='record class', default='record')
+    parser.add_argument('-E', default='Extension', help='Directory to Extension folder')
+    parser.add_argument('--host', default='127.0.0.1', help='Address of the service')
+    parser.add_argument('--port', type=int, default=9999, help='UDP port of the service (serve mode)')
+    parser.add_argument('--peers', type=int, default=1000, help='Number of simulated peers (bench mode)')
+    parser.add_argument('--interval', type=float, default=0.1, help='Heartbeat interval in seconds (bench mode)')
+    parser.add_argument('--duration', type=float, default=10.0, help='Length of the run in seconds (bench mode)')
+    parser.add_argument('--crash', type=float, default=0.01, help='Fraction of peers that crash (bench mode)')
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        try:
+            asyncio.run(serve(args.lang, args.rec, args.E, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        result = asyncio.run(benchmark(args.lang, args.rec, args.E, args.peers, args.interval, args.duration,
+                                       args.crash, host=args.host))
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,299 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from accrual import accural_estimate_for_n_array, accural_estimate_for_single_value, accural_sweep_phi
+from bertier_estimate import bertier_estimate_for_n_array, bertier_estimate_for_parameter_array, \
+    bertier_estimate_for_single_value
+from chen_estimate import chen_estimate_for_n_array, chen_estimate_for_single_value, chen_estimate_vectorized, \
+    chen_sweep_alpha
+from Extension.newrecord import Newrecord
+from Extension.record import Record
+from resource_usage import TaskUsage
+from run import DELTA, list_nodes, load_pairs, run_pairs, translate_function
+from synthetic import TraceModel, synthesize, synthesize_pair, START
+from trace_store import TRACE_FILE, build_store, is_valid, read_trace
+
+N = 1000  # window size of the Records and single-value estimators, as in the language files
+CONFIGURATIONS = 16  # number of parameter values of the array estimators
+
+
+def synthetic_trace(size, seed=0):
+    """
+    This function is used to generate the arrival times of one synthetic (receiver, sender) pair.
+
+    Args:
+        size (int): number of heartbeats sent
+        seed (int): random seed
+
+    Returns:
+        np.array: arrival times (a few are lost)
+    """
+    model = TraceModel(loss=0.001, burst_rate=0.0005)
+    chunks = synthesize_pair(model, np.random.default_rng(seed), size, size, START, None, 0, 0.0, None)
+    return np.concatenate(list(chunks))
+
+
+def real_trace(data_file, size):
+    """
+    This function is used to get the first arrival times of the longest (receiver, sender) pair of a real traces folder.
+
+    Args:
+        data_file (str): path to the traces folder
+        size (int): number of arrival times
+
+    Returns:
+        np.array: the arrival times, None if the folder has no trace or its longest pair is shorter than size
+    """
+    if not os.path.isdir(data_file):
+        return None
+    directories = [i for i in list_nodes(data_file)
+                   if is_valid(os.path.join(data_file, i)) or os.path.exists(os.path.join(data_file, i, TRACE_FILE))]
+    longest = max((array for i, j, array in load_pairs(data_file, directories)), key=len, default=None)
+    if longest is None or len(longest) < size:
+        return None
+    return np.array(longest[:size])
+
+
+def _append(record, enviornment):
+    for arrival_time in enviornment:
+        record.append(arrival_time)
+
+
+def _append_get_difference(record, enviornment):
+    for arrival_time in enviornment:
+        record.append(arrival_time)
+        record.get_difference()
+
+
+def _append_get_interval(record, enviornment):
+    for arrival_time in enviornment:
+        record.append(arrival_time)
+        record.get_interval()
+
+
+def trace_cases(enviornment):
+    """
+    This function is used to list the hot paths that run over one trace.
+
+    Args:
+        enviornment (np.array): arrival times
+
+    Returns:
+        list: (case name, heartbeats processed, function without arguments)
+    """
+    size = len(enviornment)
+    alpha = np.linspace(0, 1e7, CONFIGURATIONS)
+    phi = np.linspace(0.5, 8, CONFIGURATIONS)
+    gamma = np.linspace(0.01, 0.5, CONFIGURATIONS)
+    n = np.linspace(10, N, CONFIGURATIONS).astype(int)
+    return [
+        ('record_append', size, lambda: _append(Record(N), enviornment)),
+        ('record_get_difference', size, lambda: _append_get_difference(Record(N), enviornment)),
+        ('newrecord_get_interval', size, lambda: _append_get_interval(Newrecord(N, DELTA, 10), enviornment)),
+        ('chen_single_value', size, lambda: chen_estimate_for_single_value(enviornment, DELTA, N, 100000)),
+        ('chen_vectorized', size, lambda: chen_estimate_vectorized(enviornment, DELTA, N, 100000)),
+        ('accrual_single_value', size, lambda: accural_estimate_for_single_value(enviornment, DELTA, N, 10)),
+        ('bertier_single_value', size,
+         lambda: bertier_estimate_for_single_value(enviornment, DELTA, N, 0, 0, 0.01, 1, 4)),
+        ('chen_alpha_array', size * CONFIGURATIONS, lambda: chen_sweep_alpha(enviornment, DELTA, N, alpha)),
+        ('accrual_phi_array', size * CONFIGURATIONS, lambda: accural_sweep_phi(enviornment, DELTA, N, phi)),
+        ('bertier_gamma_array', size * CONFIGURATIONS,
+         lambda: bertier_estimate_for_parameter_array(enviornment, DELTA, N, 0, 0, gamma, 1, 4)),
+        ('chen_n_array', size * CONFIGURATIONS, lambda: chen_estimate_for_n_array(enviornment, DELTA, n, 100000)),
+        ('accrual_n_array', size * CONFIGURATIONS, lambda: accural_estimate_for_n_array(enviornment, DELTA, n, 10)),
+        ('bertier_n_array', size * CONFIGURATIONS,
+         lambda: bertier_estimate_for_n_array(enviornment, DELTA, n, 0, 0, 0.01, 1, 4)),
+    ]
+
+
+def measure(function, repeat=3, memory=True):
+    """
+    This function is used to time a case: the fastest of repeat runs is kept, and the peak memory is measured in one
+    more run under tracemalloc (which would distort the timing).
+
+    Args:
+        function (function): the case, called without arguments
+        repeat (int): number of timed runs
+        memory (bool): whether to measure the peak memory
+
+    Returns:
+        tuple: (TaskUsage of the fastest run, peak memory in MB or None, value returned by the last run)
+    """
+    best = None
+    for _ in range(repeat):
+        with TaskUsage() as usage:
+            value = function()
+        if best is None or usage.wall_time < best.wall_time:
+            best = usage
+    peak_memory = None
+    if memory:
+        with TaskUsage(trace_memory=True) as memory_usage:
+            function()
+        peak_memory = memory_usage.peak_memory
+    return best, peak_memory, value
+
+
+def children_cpu():
+    # CPU time of the terminated child processes (e.g. pool workers), None where it is not available
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def record(case, trace, size, usage, peak_memory, heartbeats=None, operations=None, workers=None):
+    """
+    This function is used to build one line of the output.
+
+    Args:
+        case (str): name of the case
+        trace (str): 'real' or 'synthetic'
+        size (int): size parameter of the run (heartbeats per trace, or rows)
+        usage (TaskUsage): resources used by the run
+        peak_memory (float): peak memory in MB, None if not measured
+        heartbeats (int): heartbeats processed by the run
+        operations (int): operations done by the run, for cases that do not process heartbeats
+        workers (int): number of pool workers, for cases that use a pool
+
+    Returns:
+        dict: JSON serializable result
+    """
+    line = {'case': case, 'trace': trace, 'size': size, 'workers': workers, 'wall_time': usage.wall_time,
+            'user_cpu': usage.user_cpu, 'system_cpu': usage.system_cpu, 'peak_memory_mb': peak_memory}
+    if heartbeats is not None:
+        line['heartbeats'] = heartbeats
+        line['heartbeats_per_second'] = heartbeats / usage.wall_time if usage.wall_time > 0 else None
+    if operations is not None:
+        line['operations'] = operations
+        line['operations_per_second'] = operations / usage.wall_time if usage.wall_time > 0 else None
+    return line
+
+
+def environment():
+    """
+    This function is used to describe where the suite ran, so that results of different runs can be compared.
+
+    Args:
+        None
+
+    Returns:
+        dict: the first line of the output
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'case': 'environment', 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit,
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def run_suite(sizes, workers, data_file='data', extension_dir='Extension', cases=None, repeat=3, memory=True):
+    """
+    This function is used to run the whole suite: the trace cases on real and synthetic traces of every size, the
+    translation of every language file, the loading of trace.csv files and run_pairs end to end for every number of
+    workers.
+
+    Args:
+        sizes (list): numbers of heartbeats per trace
+        workers (list): numbers of pool workers of the end-to-end runs
+        data_file (str): path to the real traces folder, skipped if it has no trace
+        extension_dir (str): path to the Extension folder
+        cases (list): names of the cases to run (a prefix selects a family, e.g. 'chen'), all of them by default
+        repeat (int): number of timed runs per case
+        memory (bool): whether to measure the peak memory
+
+    Returns:
+        generator: one dict per result, the first one describes the environment
+    """
+    def selected(name):
+        return cases is None or any(name.startswith(case) for case in cases)
+
+    yield environment()
+    for size in sizes:
+        traces = [('synthetic', synthetic_trace(size)), ('real', real_trace(data_file, size))]
+        for trace, enviornment in traces:
+            if enviornment is None:
+                continue
+            for name, heartbeats, function in trace_cases(enviornment):
+                if selected(name):
+                    usage, peak_memory, _ = measure(function, repeat, memory)
+                    yield record(name, trace, size, usage, peak_memory, heartbeats=heartbeats)
+
+    language_files = sorted(os.path.splitext(f)[0] for f in os.listdir(extension_dir) if f.endswith('.txt'))
+    if selected('translate'):
+        def translate_all():
+            for language_file in language_files:
+                record_class = language_file.split('_')[1] if '_' in language_file else 'record'
+                exec(compile(translate_function(language_file, record_class, extension_dir), '<fd>', 'exec'), {})
+        usage, peak_memory, _ = measure(translate_all, repeat, memory)
+        yield record('translate', None, len(language_files), usage, peak_memory, operations=len(language_files))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            if selected('csv'):
+                node_path = os.path.join(tmp, 'csv{}'.format(size))
+                os.makedirs(node_path)
+                rng = np.random.default_rng(size)
+                pd.DataFrame({'site': rng.integers(0, 8, size), 'numseq': np.arange(size),
+                              'timestamp_send': START + np.arange(size) * int(DELTA),
+                              'timestamp_receive': START + np.arange(size) * int(DELTA) + 5000000,
+                              'hops': 14}).to_csv(os.path.join(node_path, TRACE_FILE), index=False)
+                for name, function in (('csv_read_trace', lambda: read_trace(os.path.join(node_path, TRACE_FILE))),
+                                       ('csv_build_store', lambda: build_store(node_path))):
+                    usage, peak_memory, _ = measure(function, repeat, memory)
+                    yield record(name, 'synthetic', size, usage, peak_memory, heartbeats=size)
+
+            if selected('run_all'):
+                # 4 nodes, i.e. 12 pairs, of size / 12 heartbeats each
+                data_path = os.path.join(tmp, 'run{}'.format(size))
+                synthesize(data_path, 4, max(size // 12, 2), TraceModel(loss=0.001), processes=1)
+                heartbeats = sum(len(array) for i, j, array in load_pairs(data_path, list_nodes(data_path)))
+                for count in workers:
+                    # the memory is the largest peak of a single pair, as measured by run.run in the workers
+                    start_cpu = children_cpu()
+                    usage, _, pair_results = measure(lambda: run_pairs('chen', data_path, 'record', count,
+                                                                      extension_dir), repeat, False)
+                    line = record('run_all', 'synthetic', size, usage, max(r[4] for r in pair_results.values()),
+                                  heartbeats=heartbeats, workers=count)
+                    line['workers_cpu'] = (children_cpu() - start_cpu) / repeat if start_cpu is not None else None
+                    yield line
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma separated numbers of heartbeats per trace")
+    parser.add_argument("--workers", default="1,2,4", help="Comma separated numbers of workers of the end-to-end runs")
+    parser.add_argument("--cases", default=None, help="Comma separated names (or prefixes) of the cases to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per case, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Do not measure the peak memory")
+    parser.add_argument("-t", default=os.path.join(os.getcwd(), "data"), help="Directory to real traces folder")
+    parser.add_argument("-E", default=os.path.join(os.getcwd(), "Extension"), help="Directory to Extension folder")
+    parser.add_argument("-o", default=None, help="Append the results to this file instead of printing them")
+    args = parser.parse_args()
+
+    out = open(args.o, 'a') if args.o else sys.stdout
+    try:
+        for line in run_suite([int(s) for s in args.sizes.split(',')], [int(w) for w in args.workers.split(',')],
+                              args.t, args.E, args.cases.split(',') if args.cases else None, args.repeat,
+                              not args.no_memory):
+            out.write(json.dumps(line) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def qos_from_expected(enviornment, expected_arrival_time):
+    """
+    This function is used to calculate the QoS metrics of a failure detector from its whole series of expected arrival
+    times, with array operations only. The detector loops in this project all compare the arrival time k with the
+    expected arrival time computed after the arrival time k - 1, and start with the first arrival time as expected.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        expected_arrival_time (np.array): expected_arrival_time[..., k] is the next expected arrival time computed
+        right after the arrival time k has been received, the last axis has the same length as enviornment and the
+        leading axes (if any) are different configurations of the detector
+
+    Returns:
+        tuple: (mistake_duration, wrong_count, pa, detection_time), with the shape of the leading axes
+    """
+    length = len(enviornment)
+    slack = np.asarray(enviornment[1:], dtype=np.float64) - expected_arrival_time[..., :-1]
+    late = slack > 0
+    mistake_duration = np.sum(np.where(late, slack, 0.0), axis=-1)
+    wrong_count = np.count_nonzero(late, axis=-1)
+    pa = (length - wrong_count) / length
+    detection_time = expected_arrival_time[..., -1] - enviornment[-1]
+    return mistake_duration, wrong_count, pa, detection_time
@@ -0,0 +1,85 @@
+import time
+import tracemalloc
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def cpu_times():
+    """
+    This function is used to get the user and system CPU time consumed by the current process so far.
+
+    Args:
+        None
+
+    Returns:
+        tuple: (user CPU time, system CPU time) in seconds
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime, usage.ru_stime
+    times = psutil.Process().cpu_times()
+    return times.user, times.system
+
+
+class TaskUsage:
+    """
+    This class is used to measure the resources used by one task (one detector run), as the difference between a
+    snapshot taken before and after it, so that the numbers do not depend on what a pool worker ran before. It can be
+    used as a context manager or with start() and stop().
+
+    The peak memory is the peak of the Python allocations made during the task, tracked with tracemalloc. Tracing
+    slows down allocation-heavy loops by an order of magnitude, so it is only enabled with trace_memory=True and
+    should not be used for the run whose CPU time is measured.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.user_cpu = 0.0
+        self.system_cpu = 0.0
+        self.wall_time = 0.0
+        self.peak_memory = None
+        self._started_tracing = False
+
+    @property
+    def cpu_time(self):
+        return self.user_cpu + self.system_cpu
+
+    def start(self):
+        if self.trace_memory:
+            if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            elif tracemalloc.is_tracing():
+                tracemalloc.clear_traces()  # Python 3.8 has no reset_peak, clearing the traces resets the peak
+            else:
+                tracemalloc.start()
+                self._started_tracing = True
+            self._start_memory = tracemalloc.get_traced_memory()[0]
+        self._start_cpu = cpu_times()
+        self._start_wall = time.perf_counter_ns()
+        return self
+
+    def stop(self):
+        end_wall = time.perf_counter_ns()
+        end_cpu = cpu_times()
+        self.wall_time = (end_wall - self._start_wall) / 1e9
+        self.user_cpu = end_cpu[0] - self._start_cpu[0]
+        self.system_cpu = end_cpu[1] - self._start_cpu[1]
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peak_memory = max(peak - self._start_memory, 0) / 1024 / 1024
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import pickle
+import re
+
+from trace_store import node_fingerprint
+
+IMPORT_PATTERN = re.compile(r'^\s*from\s+Extension\.(\w+)\s+import', re.MULTILINE)
+
+
+def record_sources(record_class, extension_dir='Extension'):
+    """
+    This function is used to collect the source code of a Record class file and of every Extension module it imports
+    (e.g. newrecord.py imports record.py, which imports _record.py).
+
+    Args:
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        dict: {module name: source code (bytes)}
+    """
+    sources = {}
+    pending = [record_class]
+    while pending:
+        module = pending.pop()
+        if module in sources:
+            continue
+        with open(os.path.join(extension_dir, '{}.py'.format(module)), 'rb') as f:
+            sources[module] = f.read()
+        pending.extend(IMPORT_PATTERN.findall(sources[module].decode('utf-8', 'replace')))
+    return sources
+
+
+def trace_fingerprint(data_file, directories):
+    """
+    This function is used to identify a set of traces by the content of every node.
+
+    Args:
+        data_file (str): path to the traces folder
+        directories (list): names of the node folders
+
+    Returns:
+        dict: {node folder: fingerprint}
+    """
+    return {i: node_fingerprint(os.path.join(data_file, i)) for i in sorted(directories)}
+
+
+def result_key(language_file, record_class, data_file, directories, extension_dir='Extension', parameters=None):
+    """
+    This function is used to compute the key of the results of an FD on a set of traces. The key only changes when
+    the language file, the Record class (or a module it imports), the traces or the parameters change.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        data_file (str): path to the traces folder
+        directories (list): names of the node folders
+        extension_dir (str): path to the Extension folder
+        parameters (dict): any other value the results depend on (must be JSON serializable)
+
+    Returns:
+        str: a hex digest
+    """
+    sha = hashlib.sha256()
+    with open(os.path.join(extension_dir, '{}.txt'.format(language_file)), 'rb') as f:
+        sha.update(f.read())
+    for module, source in sorted(record_sources(record_class, extension_dir).items()):
+        sha.update(module.encode())
+        sha.update(hashlib.sha256(source).digest())
+    sha.update(json.dumps({'record_class': record_class,
+                           'traces': trace_fingerprint(data_file, directories),
+                           'parameters': parameters}, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """
+    This class is used to store the per-pair results of an FD on disk, one pickle file per result key.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '{}.pkl'.format(key))
+
+    def get(self, key):
+        """
+        This method is used to get stored results.
+
+        Args:
+            key (str): result key
+
+        Returns:
+            dict: {(receiver folder, sender folder): tuple returned by run.run}, None if the key is not stored
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, pair_results):
+        """
+        This method is used to store results.
+
+        Args:
+            key (str): result key
+            pair_results (dict): {(receiver folder, sender folder): tuple returned by run.run}
+
+        Returns:
+            None
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(self._path(key), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(pair_results, f)
+        os.replace(tmp_path, self._path(key))
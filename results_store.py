@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from trace_store import ArrayWriter
+
+RESULTS_DIR = '.benchmark_results'
+TABLE = 'table.json'
+KEYS = ('fd', 'params', 'receiver', 'sender')  # dictionary encoded, the rows are sorted by them in this order
+METRICS = {'mistake_duration': np.float64,  # ms
+           'detection_time': np.float64,  # ms
+           'pa': np.float64,
+           'wrong_count': np.int64,
+           'cpu': np.float64,  # s
+           'memory': np.float64,  # MB
+           'wall_time': np.float64}  # s
+BLOCK_ROWS = 1 << 16  # rows buffered before they are appended to the column files
+_DICTIONARY = {'fd': 'fd', 'params': 'params', 'receiver': 'node', 'sender': 'node'}  # dictionary of every key
+
+
+def result_row(result):
+    """
+    This function is used to get the metrics of one pair from the tuple returned by run.run, in the units of METRICS.
+
+    Args:
+        result (tuple): tuple returned by run.run
+
+    Returns:
+        tuple: values of METRICS, in order
+    """
+    return result[0] / 1000000, result[1] / 1000000, result[2], result[8], result[3], result[4], result[7]
+
+
+class ResultsWriter:
+    """
+    This class is used to write the per-pair results of a benchmark run as a columnar table: one .npy file per column,
+    the keys (FD, parameters, receiver, sender) being stored as int32 codes into dictionaries kept in TABLE. Rows are
+    buffered BLOCK_ROWS at a time and appended to the column files with ArrayWriter. On close, the columns are sorted
+    by the keys so that a FD, and a pair inside it, is found by binary search (see ResultsTable.query). The run is
+    written to a temporary directory renamed on close, so an interrupted writer leaves no table behind. It can be used
+    as a context manager.
+    """
+
+    def __init__(self, results_dir=RESULTS_DIR, run_id=None):
+        self.run_id = run_id or datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f')
+        self.path = os.path.join(results_dir, self.run_id)
+        self.tmp_path = self.path + '.tmp'
+        os.makedirs(self.tmp_path)
+        self.dictionaries = {'fd': {}, 'params': {}, 'node': {}}  # {dictionary: {value: code}}
+        self.buffer = {column: [] for column in KEYS + tuple(METRICS)}
+        self.writers = {key: ArrayWriter(os.path.join(self.tmp_path, key + '.npy'), dtype=np.int32) for key in KEYS}
+        for metric, dtype in METRICS.items():
+            self.writers[metric] = ArrayWriter(os.path.join(self.tmp_path, metric + '.npy'), dtype=dtype)
+        self.rows = 0
+        self._params = (None, None)  # last params and their JSON, a run usually has the same params for every row
+
+    def _code(self, key, value):
+        dictionary = self.dictionaries[_DICTIONARY[key]]
+        if value not in dictionary:
+            dictionary[value] = len(dictionary)
+        return dictionary[value]
+
+    def append(self, fd, params, pair, result):
+        """
+        This method is used to add the result of one pair.
+
+        Args:
+            fd (str): name of the language file
+            params (dict): parameters of the run (JSON serializable), e.g. run.result_parameters()
+            pair (tuple): (receiver folder, sender folder)
+            result (tuple): tuple returned by run.run
+
+        Returns:
+            None
+        """
+        if params is not self._params[0]:
+            self._params = (params, json.dumps(params, sort_keys=True))
+        keys = (fd, self._params[1]) + tuple(pair)
+        for key, value in zip(KEYS, keys):
+            self.buffer[key].append(self._code(key, value))
+        for metric, value in zip(METRICS, result_row(result)):
+            self.buffer[metric].append(value)
+        self.rows += 1
+        if len(self.buffer['fd']) >= BLOCK_ROWS:
+            self._flush()
+
+    def _flush(self):
+        for column, values in self.buffer.items():
+            self.writers[column].append(np.array(values))
+            values.clear()
+
+    def close(self):
+        """
+        This method is used to sort the table by its keys and publish it. Sorting loads one column at a time.
+
+        Args:
+            None
+
+        Returns:
+            str: path to the run directory
+        """
+        self._flush()
+        for writer in self.writers.values():
+            writer.close()
+        columns = {column: os.path.join(self.tmp_path, column + '.npy') for column in self.writers}
+        order = np.lexsort([np.load(columns[key], mmap_mode='r') for key in reversed(KEYS)])
+        for column, path in columns.items():
+            np.save(path, np.load(path)[order])
+        del order
+        table = {'rows': self.rows, 'keys': list(KEYS), 'metrics': list(METRICS),
+                 'dictionaries': {name: list(dictionary) for name, dictionary in self.dictionaries.items()}}
+        with open(os.path.join(self.tmp_path, TABLE), 'w') as f:
+            json.dump(table, f)
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        for writer in self.writers.values():
+            if not writer.file.closed:
+                writer.file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class ResultsTable:
+    """
+    This class is used to query the table of one run written by ResultsWriter. The columns are memory-mapped, and a
+    filter on a prefix of KEYS (the FD, then the parameters, the receiver and the sender) narrows the rows by binary
+    search on the sorted codes, so only the matching rows are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, TABLE)) as f:
+            table = json.load(f)
+        self.rows = table['rows']
+        self.dictionaries = table['dictionaries']
+        self.codes = {name: {value: code for code, value in enumerate(values)}
+                      for name, values in self.dictionaries.items()}
+        self.columns = {}
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self.columns[name]
+
+    def _rows(self, filters):
+        # (start, stop, mask or None) of the rows matching filters
+        start, stop = 0, self.rows
+        mask = None
+        prefix = True
+        for key in KEYS:
+            value = filters.get(key)
+            if value is None:
+                prefix = False
+                continue
+            if key == 'params' and not isinstance(value, str):
+                value = json.dumps(value, sort_keys=True)
+            code = self.codes[_DICTIONARY[key]].get(value)
+            if code is None:
+                return 0, 0, None
+            column = self.column(key)[start:stop]
+            if prefix:
+                # the rows are sorted by the keys, so the previous keys being fixed, this one is sorted too
+                start, stop = start + np.searchsorted(column, code, 'left'), \
+                    start + np.searchsorted(column, code, 'right')
+            else:
+                match = np.asarray(column) == code
+                mask = match if mask is None else mask & match
+        return start, stop, mask
+
+    def query(self, fd=None, params=None, receiver=None, sender=None, metrics=None):
+        """
+        This method is used to select the rows of some FDs, parameters or pairs.
+
+        Args:
+            fd (str): name of the language file, None for all of them
+            params (dict or str): parameters of the run (or their JSON), None for all of them
+            receiver (str): receiver folder, None for all of them
+            sender (str): sender folder, None for all of them
+            metrics (list): names of the METRICS columns to read, None for all of them
+
+        Returns:
+            pd.DataFrame: one row per matching (FD, parameters, receiver, sender), the keys as categoricals
+        """
+        start, stop, mask = self._rows({'fd': fd, 'params': params, 'receiver': receiver, 'sender': sender})
+        data = {}
+        for key in KEYS:
+            codes = np.asarray(self.column(key)[start:stop])
+            if mask is not None:
+                codes = codes[mask]
+            data[key] = pd.Categorical.from_codes(codes, self.dictionaries[_DICTIONARY[key]])
+        for metric in metrics or METRICS:
+            values = np.asarray(self.column(metric)[start:stop])
+            data[metric] = values[mask] if mask is not None else values
+        return pd.DataFrame(data)
+
+    def pivot(self, metric, fd, params=None, index='receiver', columns='sender', aggfunc='mean'):
+        """
+        This method is used to lay out a metric of an FD as a matrix, e.g. receivers x senders, to find the pairs that
+        make its score.
+
+        Args:
+            metric (str): name of a METRICS column
+            fd (str): name of the language file
+            params (dict or str): parameters of the run (or their JSON), None to aggregate all of them
+            index (str): key of the rows
+            columns (str): key of the columns
+            aggfunc (str): how the rows falling in the same cell are aggregated
+
+        Returns:
+            pd.DataFrame: the matrix
+        """
+        df = self.query(fd, params, metrics=[metric])
+        return df.pivot_table(metric, index=index, columns=columns, aggfunc=aggfunc, observed=True)
+
+
+def list_runs(results_dir=RESULTS_DIR):
+    """
+    This function is used to list the runs of a results folder.
+
+    Args:
+        results_dir (str): path to the results folder
+
+    Returns:
+        list: run ids, oldest first
+    """
+    if not os.path.isdir(results_dir):
+        return []
+    return sorted(run_id for run_id in os.listdir(results_dir)
+                  if os.path.exists(os.path.join(results_dir, run_id, TABLE)))
+
+
+def open_run(results_dir=RESULTS_DIR, run_id=None):
+    """
+    This function is used to open the table of a run.
+
+    Args:
+        results_dir (str): path to the results folder
+        run_id (str): id of the run, None for the latest one
+
+    Returns:
+        ResultsTable: the table
+    """
+    if run_id is None:
+        runs = list_runs(results_dir)
+        if not runs:
+            raise FileNotFoundError('no run in {}'.format(results_dir))
+        run_id = runs[-1]
+    return ResultsTable(os.path.join(results_dir, run_id))
+
+
+def query_runs(results_dir=RESULTS_DIR, runs=None, **filters):
+    """
+    This function is used to select rows across several runs, e.g. to compare the same pair between runs.
+
+    Args:
+        results_dir (str): path to the results folder
+        runs (list): run ids, None for all of them
+        **filters: arguments of ResultsTable.query
+
+    Returns:
+        pd.DataFrame: the matching rows, with a 'run' column
+    """
+    frames = []
+    for run_id in runs or list_runs(results_dir):
+        df = open_run(results_dir, run_id).query(**filters)
+        df.insert(0, 'run', run_id)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=('run',) + KEYS + tuple(METRICS))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", default=os.path.join(os.getcwd(), RESULTS_DIR), help="Directory to results folder")
+    parser.add_argument("--run", help="Id of the run (the latest one by default)")
+    parser.add_argument("--fd", help="Only this FD (language file name)")
+    parser.add_argument("--receiver", help="Only this receiver folder (e.g. Node0)")
+    parser.add_argument("--sender", help="Only this sender folder (e.g. Node1)")
+    parser.add_argument("--pivot", choices=list(METRICS),
+                        help="Print this metric of --fd as a receiver x sender matrix")
+    parser.add_argument("--sort", choices=list(METRICS), help="Sort the rows by this metric, largest first")
+    parser.add_argument("-n", type=int, default=20, help="Number of rows printed")
+    args = parser.parse_args()
+
+    table = open_run(args.r, args.run)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        if args.pivot:
+            if args.fd is None:
+                parser.error('--pivot needs --fd')
+            print(table.pivot(args.pivot, args.fd))
+        else:
+            rows = table.query(args.fd, receiver=args.receiver, sender=args.sender)
+            if args.sort:
+                rows = rows.sort_values(args.sort, ascending=False)
+            print(rows.head(args.n))
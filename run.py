@@ -7,18 +7,45 @@ import time
 import multiprocessing
 import copy
 import concurrent.futures
+import hashlib
+import marshal
+import sys
+from functools import partial
 
+from heartbeat_stream import prefix_chunks
+from resource_usage import TaskUsage
+from running_stats import PairAggregator
+from trace_store import ArrayHandle, iter_pair_chunks, load_node, open_array, pair_handle, pair_handles
 
-def translate(language_file, record_class):
-    with open(r'.\Extension\{}.txt'.format(language_file)) as f:
+COMPILER_VERSION = b'6'  # bump when translate or translate_function change the generated code
+_detectors = {}  # per-process cache of compiled detectors
+_memory = {}  # per-process cache of the peak memory of every detector, see detector_memory
+MEMORY_PROBE_LENGTH = 2000  # number of arrival times replayed under tracemalloc to measure the peak memory
+DELTA = 100000000.0  # sending interval of the heartbeats in the traces
+
+
+def translate(language_file, record_class, extension_dir='Extension', mode='array'):
+    with open(os.path.join(extension_dir, '{}.txt'.format(language_file))) as f:
         language = f.read()
     language = language.replace('\n', '')
     language = language.replace(' ', '')
     language_list = language.split(';')
     class_name = record_class.capitalize()
-    code = """from Extension.{} import {}\nimport os\nimport psutil\nimport numpy as np\nimport math\n\n""".format(
+    code = """from Extension.{} import {}\nimport os\nimport numpy as np\nimport math\n""".format(
         record_class, class_name)
-    code += """pid = os.getpid()\nnext_expected_arrival_time = enviornment[0]\nmistake_duration = 0\nwrong_count = 0\n"""
+    if mode == 'stream':
+        # enviornment is an iterable of chunks of arrival times, see heartbeat_stream.py
+        code += """from heartbeat_stream import HeartbeatStream\n\nheartbeats = HeartbeatStream(enviornment)\n"""
+        code += """next_expected_arrival_time = heartbeats.first\nmistake_duration = 0\nwrong_count = 0\n"""
+    elif mode == 'monitor':
+        # the arrival times are sent into a generator one by one, which yields the next expected arrival time
+        code += """\narrival_time = yield\nnext_expected_arrival_time = arrival_time\nmistake_duration = 0\n"""
+        code += """wrong_count = 0\n"""
+    else:
+        code += """\nnext_expected_arrival_time = enviornment[0]\nmistake_duration = 0\nwrong_count = 0\n"""
+        if mode == 'series':
+            # the next expected arrival time computed after every arrival time, see crash_injection.py
+            code += """expected_arrival_times = np.empty(len(enviornment))\n"""
     for i in language_list:
         if i != '':
             label = i.split(':')[0]
@@ -34,7 +61,13 @@ def translate(language_file, record_class):
                         code += j + '\n'
                     code += '\n'
 
-                code += 'for arrival_time in enviornment:\n' + '\t{}.append(arrival_time)\n'.format(record_class)
+                if mode == 'monitor':
+                    code += 'while True:\n'
+                elif mode == 'series':
+                    code += 'for index, arrival_time in enumerate(enviornment):\n'
+                else:
+                    code += 'for arrival_time in {}:\n'.format('heartbeats' if mode == 'stream' else 'enviornment')
+                code += '\t{}.append(arrival_time)\n'.format(record_class)
 
             if label == 'Inside':
                 # means this content should be added to the code inside the for loop
@@ -52,76 +85,405 @@ def translate(language_file, record_class):
                 code += '\tnext_expected_arrival_time={}\n'.format(
                     content.replace('A', 'arrival_time').replace('E', 'next_expected_arrival_time'))
 
-    code += 'detection_time = next_expected_arrival_time - enviornment[-1]\nif detection_time < 0:\n'
-    code += '\tdetection_time = 0\npa = (len(enviornment) - wrong_count) / len(enviornment)\n'
-    code += 'cpu_time = psutil.Process(pid).cpu_times().system\n'
-    code += 'memory = psutil.Process(pid).memory_info().rss / 1024 / 1024\n'
+    if mode == 'monitor':
+        code += '\tarrival_time = yield next_expected_arrival_time\n'
+    elif mode == 'series':
+        code += '\texpected_arrival_times[index] = next_expected_arrival_time\n'
+    elif mode == 'stream':
+        code += 'detection_time = next_expected_arrival_time - heartbeats.last\nif detection_time < 0:\n'
+        code += '\tdetection_time = 0\npa = (heartbeats.count - wrong_count) / heartbeats.count\n'
+    else:
+        code += 'detection_time = next_expected_arrival_time - enviornment[-1]\nif detection_time < 0:\n'
+        code += '\tdetection_time = 0\npa = (len(enviornment) - wrong_count) / len(enviornment)\n'
 
     return code
 
 
-def run(enviornment, language_file, record_class):
-    code = translate(language_file, record_class)
-    g = {}
-    exec(code, {'enviornment': enviornment, 'delta': 100000000.0}, g)
-    return g['mistake_duration'], g['detection_time'], g['pa'], g['cpu_time'], g['memory']
+def translate_function(language_file, record_class, extension_dir='Extension'):
+    """
+    This function is used to wrap the code generated by translate into functions, so that the variables of the
+    detector loop are locals instead of module-level globals:
+    'detector(enviornment, delta)' over a whole array of arrival times,
+    'stream_detector(enviornment, delta)' over an iterable of chunks of arrival times,
+    'monitor(delta)', a generator that is sent the arrival times one by one as they happen and yields the next expected
+    arrival time after each of them (the first send must be preceded by next()), and
+    'expected_arrivals(enviornment, delta)', which returns the next expected arrival time computed after every arrival
+    time of an array as an array of the same length.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        str: source code of a module defining the 'detector', 'stream_detector', 'monitor' and 'expected_arrivals'
+        functions
+    """
+    functions = ''
+    for name, mode, arguments in (('detector', 'array', 'enviornment, delta'),
+                                  ('stream_detector', 'stream', 'enviornment, delta'), ('monitor', 'monitor', 'delta'),
+                                  ('expected_arrivals', 'series', 'enviornment, delta')):
+        # the imports of the stream variant are a superset of the other ones
+        body = translate(language_file, record_class, extension_dir, mode).split('\n\n', 1)[1]
+        functions += '\n\ndef {}({}):\n'.format(name, arguments)
+        for line in body.split('\n'):
+            if line != '':
+                functions += '\t' + line + '\n'
+        if mode == 'series':
+            functions += '\treturn expected_arrival_times\n'
+        elif mode != 'monitor':
+            functions += '\treturn mistake_duration, detection_time, pa, wrong_count\n'
+    header = translate(language_file, record_class, extension_dir, 'stream').split('\n\n', 1)[0]
+    return header + '\n' + functions
+
+
+def compile_detector(language_file, record_class, extension_dir='Extension'):
+    """
+    This function is used to compile a language file into ready-to-call detector functions. The compiled code object
+    is cached on disk (in the '__pycache__' folder of the Extension folder), keyed by the hash of the language file, so
+    the language file is only translated and compiled again when it changes.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        dict: {'detector': detector(enviornment, delta), 'stream_detector': stream_detector(enviornment, delta),
+        'monitor': monitor(delta), 'expected_arrivals': expected_arrivals(enviornment, delta)}, see translate_function
+    """
+    with open(os.path.join(extension_dir, '{}.txt'.format(language_file)), 'rb') as f:
+        language = f.read()
+    key = hashlib.sha256(b'\0'.join([COMPILER_VERSION, record_class.encode(), language])).hexdigest()
+    cache_path = os.path.join(extension_dir, '__pycache__', '{}.{}.{}.fdc'.format(
+        language_file, sys.implementation.cache_tag, key[:16]))
+    try:
+        with open(cache_path, 'rb') as f:
+            code = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        source = translate_function(language_file, record_class, extension_dir)
+        code = compile(source, '<fd {}>'.format(language_file), 'exec')
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # the cache is an optimization only, a read-only Extension folder still works
+    namespace = {}
+    exec(code, namespace)
+    return {name: namespace[name] for name in ('detector', 'stream_detector', 'monitor', 'expected_arrivals')}
+
+
+def load_detector(language_file, record_class, extension_dir='Extension', name='detector'):
+    """
+    This function is used to get the detector of a language file, compiling it at most once per process.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+        name (str): 'detector' (over an array), 'stream_detector' (over an iterable of chunks), 'monitor' (live) or
+        'expected_arrivals' (series of expected arrival times over an array)
+
+    Returns:
+        function: detector(enviornment, delta)
+    """
+    language_path = os.path.join(extension_dir, '{}.txt'.format(language_file))
+    stat = os.stat(language_path)
+    key = (os.path.abspath(language_path), record_class, stat.st_size, stat.st_mtime_ns)
+    if key not in _detectors:
+        _detectors[key] = compile_detector(language_file, record_class, extension_dir)
+    return _detectors[key][name]
+
+
+def detector_memory(language_file, record_class, extension_dir, name, probe):
+    """
+    This function is used to get the peak memory of a detector: the peak of its allocations, tracked with tracemalloc
+    while it runs on a short trace. The state of a detector is its Record, bounded by the window size, so the peak does
+    not depend on the trace; it is measured on the first trace a process runs the detector on and reused afterwards,
+    instead of paying one more traced run (about 15 times slower than the timed one) per task.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+        name (str): 'detector' or 'stream_detector'
+        probe (function): called as probe(detector) to run the detector on a short trace
+
+    Returns:
+        float: the peak memory in MB
+    """
+    key = (language_file, record_class, os.path.abspath(extension_dir), name)
+    if key not in _memory:
+        detector = load_detector(language_file, record_class, extension_dir, name)
+        with TaskUsage(trace_memory=True) as memory_usage:
+            probe(detector)
+        _memory[key] = memory_usage.peak_memory
+    return _memory[key]
+
+
+def run(enviornment, language_file, record_class, extension_dir='Extension'):
+    """
+    This function is used to run a detector on one trace and measure the resources it uses. The CPU time (user +
+    system) and the wall time are the differences of snapshots taken around the detector run. The memory is the peak
+    memory of the detector (see detector_memory), probed on the first MEMORY_PROBE_LENGTH arrival times.
+
+    Args:
+        enviornment (np.array): arrival times of the heartbeats
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        tuple: (mistake_duration, detection_time, pa, cpu_time, memory, user_cpu, system_cpu, wall_time,
+        wrong_count), mistake_duration and detection_time are in ns, the other times in seconds and memory in MB
+    """
+    detector = load_detector(language_file, record_class, extension_dir)
+    with TaskUsage() as usage:
+        mistake_duration, detection_time, pa, wrong_count = detector(enviornment, DELTA)
+    memory = detector_memory(language_file, record_class, extension_dir, 'detector',
+                             lambda probed: probed(enviornment[:MEMORY_PROBE_LENGTH], DELTA))
+    return mistake_duration, detection_time, pa, usage.cpu_time, memory, usage.user_cpu, usage.system_cpu, \
+        usage.wall_time, wrong_count
+
+
+def run_stream(open_chunks, language_file, record_class, extension_dir='Extension'):
+    """
+    This function is the streaming counterpart of run: the detector consumes the trace chunk by chunk and carries its
+    state (the Record, the next expected arrival time and the accumulators) across chunk boundaries, so the memory used
+    does not depend on the length of the trace. The results are the same as run on the concatenated chunks.
+
+    Args:
+        open_chunks (function): called without arguments, returns a new iterable of np.array chunks of arrival times
+        (it is called again for the memory probe the first time the process runs the detector)
+        language_file (str): name of the language file (without '.txt')
+        record_class (str): name of the Record class file (without '.py')
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        tuple: same as run
+    """
+    stream_detector = load_detector(language_file, record_class, extension_dir, 'stream_detector')
+    with TaskUsage() as usage:
+        mistake_duration, detection_time, pa, wrong_count = stream_detector(open_chunks(), DELTA)
+    memory = detector_memory(language_file, record_class, extension_dir, 'stream_detector',
+                             lambda probed: probed(prefix_chunks(open_chunks(), MEMORY_PROBE_LENGTH), DELTA))
+    return mistake_duration, detection_time, pa, usage.cpu_time, memory, usage.user_cpu, usage.system_cpu, \
+        usage.wall_time, wrong_count
+
+
+def load_pairs(data_file, directories):
+    """
+    This function is the loader stage of the benchmark: every node's trace is loaded only once, already split by
+    sender, and the (receiver, sender) pairs are yielded from it.
+
+    Args:
+        data_file (str): path to the traces folder
+        directories (list): names of the node folders (e.g. 'Node0')
+
+    Returns:
+        generator: (receiver folder, sender folder, np.array of arrival times)
+    """
+    for i in directories:
+        arrays = load_node(os.path.join(data_file, i))
+        for j in directories:
+            if i != j:
+                yield i, j, arrays.get(int(j[4:]), np.array([], dtype=np.int64))
+
+
+def pair_schedule(data_file, directories):
+    """
+    This function is the loader stage of run_many: it reads the length of the arrival times of every (receiver,
+    sender) pair from the trace store, into flat arrays, so that the task matrix can be ordered without holding one
+    object per pair. The handles themselves are only read when a task is dispatched (see trace_store.pair_handle).
+
+    Args:
+        data_file (str): path to the traces folder
+        directories (list): names of the node folders (e.g. 'Node0')
+
+    Returns:
+        tuple: (np.array of lengths, np.array of receiver indexes, np.array of sender indexes) into directories, without
+        the pairs whose receiver never received anything from the sender (e.g. a node that only has sent logs)
+    """
+    count = len(directories)
+    lengths = np.empty(count * (count - 1), dtype=np.int64)
+    receivers = np.repeat(np.arange(count, dtype=np.int32), count - 1)
+    senders = np.empty(len(lengths), dtype=np.int32)
+    position = 0
+    for r, i in enumerate(directories):
+        handles = pair_handles(os.path.join(data_file, i))
+        for s, j in enumerate(directories):
+            if r != s:
+                handle = handles.get(int(j[4:]))
+                lengths[position] = handle.length if handle is not None else 0
+                senders[position] = s
+                position += 1
+    # there is nothing to detect on an empty pair
+    received = lengths > 0
+    return lengths[received], receivers[received], senders[received]
+
+
+def result_parameters():
+    """
+    This function is used to list the values, besides the FD and the traces, that the results of run depend on.
+
+    Args:
+        None
+
+    Returns:
+        dict: JSON serializable parameters, used in the result cache key
+    """
+    return {'delta': DELTA, 'compiler': COMPILER_VERSION.decode(), 'memory_probe': MEMORY_PROBE_LENGTH}
+
+
+def list_nodes(data_file):
+    """
+    This function is used to list the node folders (e.g. 'Node0') of a traces folder.
 
+    Args:
+        data_file (str): path to the traces folder
 
-def run_all(language_file, data_file, record_class, processes=32):
-    pool = multiprocessing.Pool(processes=processes)
-    results = []
+    Returns:
+        list: names of the node folders
+    """
     directories = []
     for item in os.listdir(data_file):
         item_path = os.path.join(data_file, item)
         if os.path.isdir(item_path):
             directories.append(item)
-    for i in directories:
-        for j in directories:
-            if i != j:
-                node_path = os.path.join(data_file, i)
-                csv_path = os.path.join(node_path, 'trace.csv')
-                df = pd.read_csv(csv_path)
-                df = df[df.site == int(j[4:])]
-                arrival_time_array = np.array(df.timestamp_receive)
-                results.append(pool.apply_async(run, (arrival_time_array, language_file, record_class,)))
-
-    # node_list = [0, 1, 3, 5, 6, 7, 8, 9]
-    # pool = multiprocessing.Pool(processes=processes)
-    # results = []
-    #
-    # for i in node_list:
-    #     receive_from_node_list = copy.deepcopy(node_list)
-    #     receive_from_node_list.remove(i)
-    #     for j in receive_from_node_list:
-    #         print(i,j)
-    #         df = pd.read_csv(r'.\data\Node{}\trace.csv'.format(i))
-    #         df = df[df.site == j]
-    #         arrival_time_array = np.array(df.timestamp_receive)
-    #         results.append(pool.apply_async(run, (arrival_time_array, language_file, record_class,)))
-    #
-
-    pool.close()
-    pool.join()
-    mistake_duration_list = []
-    detection_time_list = []
-    pa_list = []
-    cpu_time_list = []
-    memory_list = []
-    for res in results:
-        mistake_duration_list.append(res.get()[0] / 1000000)
-        detection_time_list.append(res.get()[1] / 1000000)
-        pa_list.append(res.get()[2])
-        cpu_time_list.append(res.get()[3])
-        memory_list.append(res.get()[4])
-
-    mistake_duration_array = np.array(mistake_duration_list)
-    detection_time_array = np.array(detection_time_list)
-    pa_array = np.array(pa_list)
-    cpu_time_array = np.array(cpu_time_list)
-    memory_array = np.array(memory_list)
-
-    return np.mean(detection_time_array), np.std(detection_time_array), np.mean(pa_array), np.std(pa_array), \
-           np.mean(mistake_duration_array), np.mean(cpu_time_array), np.mean(memory_array)
+    return directories
+
+
+def run_task(task):
+    """
+    This function is used to run one task of the scheduler in a pool worker.
+
+    Args:
+        task (tuple): (language file, record class, extension folder, receiver folder, sender folder, arrival times),
+        the arrival times are an np.array, an ArrayHandle or a function opening them as chunks (see run_stream)
+
+    Returns:
+        tuple: (language file, (receiver folder, sender folder), tuple returned by run)
+    """
+    language_file, record_class, extension_dir, i, j, arrival_times = task
+    if callable(arrival_times):
+        return language_file, (i, j), run_stream(arrival_times, language_file, record_class, extension_dir)
+    if isinstance(arrival_times, ArrayHandle):
+        arrival_times = open_array(arrival_times)
+    return language_file, (i, j), run(arrival_times, language_file, record_class, extension_dir)
+
+
+def run_many(failure_detectors, data_file, processes=32, extension_dir='Extension', on_fd_complete=None,
+             on_result=None, completed=None, chunk_size=None, keep_results=True, sketch=False):
+    """
+    This function is used to run several FDs on every (receiver, sender) pair of a traces folder with a single pool.
+    The whole FD x pair task matrix is scheduled longest trace first, so the pool does not sit idle waiting for the
+    slowest pair of one FD before the next FD starts. The workers receive handles on the arrays of the trace store and
+    map them, so no array is copied through the pool.
+
+    The tasks are generated as the pool takes them and the results are folded into one PairAggregator per FD as they
+    complete, so without keep_results the memory of this process does not grow with the number of pairs.
+
+    Args:
+        failure_detectors (dict): {language file (without '.txt'): record class (without '.py')}
+        data_file (str): path to the traces folder
+        processes (int): number of processes of the pool
+        extension_dir (str): path to the Extension folder
+        on_fd_complete (function): called as on_fd_complete(language file, PairAggregator) as soon as all the pairs of
+        an FD are done
+        on_result (function): called as on_result(language file, (receiver folder, sender folder), tuple returned by
+        run) as soon as a task is done
+        completed (dict): {language file: {(receiver folder, sender folder): tuple returned by run}} of the tasks
+        already done (e.g. read back from a journal), they are not run again
+        chunk_size (int): if given, the workers stream every pair from the trace store chunk_size arrival times at a
+        time (see run_stream) instead of receiving the whole array
+        keep_results (bool): whether the aggregators also keep the result of every pair (PairAggregator.pairs)
+        sketch (bool): whether the aggregators also estimate quantiles (PairAggregator.quantiles)
+
+    Returns:
+        dict: {language file: PairAggregator}
+    """
+    # compile before forking so that workers inherit the detectors (or find them in the on-disk cache)
+    for language_file, record_class in failure_detectors.items():
+        load_detector(language_file, record_class, extension_dir)
+    directories = list_nodes(data_file)
+    lengths, receivers, senders = pair_schedule(data_file, directories)
+    completed = completed or {}
+    aggregators = {}
+    for language_file in failure_detectors:
+        aggregators[language_file] = PairAggregator(keep_results, sketch)
+        for pair, result in completed.get(language_file, {}).items():
+            aggregators[language_file].add(pair, result)
+
+    def tasks():
+        fds = list(failure_detectors.items())
+        # stable, so equal lengths keep the FD-major order
+        for index in np.argsort(-np.tile(lengths, len(fds)), kind='stable'):
+            language_file, record_class = fds[index // len(lengths)]
+            i, j = directories[receivers[index % len(lengths)]], directories[senders[index % len(lengths)]]
+            if (i, j) in completed.get(language_file, ()):
+                continue
+            node_path = os.path.join(data_file, i)
+            if chunk_size is not None:
+                arrival_times = partial(iter_pair_chunks, node_path, int(j[4:]), chunk_size)
+            else:
+                arrival_times = pair_handle(node_path, int(j[4:]))
+            yield language_file, record_class, extension_dir, i, j, arrival_times
+
+    for language_file, aggregator in aggregators.items():
+        # also when the traces folder has no pair, so every FD is reported (with the metrics of no pair)
+        if aggregator.count == len(lengths) and on_fd_complete is not None:
+            on_fd_complete(language_file, aggregator)
+    if all(aggregator.count == len(lengths) for aggregator in aggregators.values()):
+        return aggregators
+    with multiprocessing.Pool(processes=processes) as pool:
+        for language_file, pair, result in pool.imap_unordered(run_task, tasks()):
+            aggregators[language_file].add(pair, result)
+            if on_result is not None:
+                on_result(language_file, pair, result)
+            if aggregators[language_file].count == len(lengths) and on_fd_complete is not None:
+                on_fd_complete(language_file, aggregators[language_file])
+    return aggregators
+
+
+def run_pairs(language_file, data_file, record_class, processes=32, extension_dir='Extension'):
+    """
+    This function is used to run a detector on every (receiver, sender) pair of a traces folder.
+
+    Args:
+        language_file (str): name of the language file (without '.txt')
+        data_file (str): path to the traces folder
+        record_class (str): name of the Record class file (without '.py')
+        processes (int): number of processes of the pool
+        extension_dir (str): path to the Extension folder
+
+    Returns:
+        dict: {(receiver folder, sender folder): tuple returned by run}
+    """
+    return run_many({language_file: record_class}, data_file, processes, extension_dir)[language_file].pairs
+
+
+def aggregate(pair_results):
+    """
+    This function is used to reduce the results of every pair into the metrics of an FD.
+
+    Args:
+        pair_results (dict): {(receiver folder, sender folder): tuple returned by run}
+
+    Returns:
+        tuple: (detection time, detection time std, pa, pa std, mistake duration, cpu, memory), times in ms
+    """
+    aggregator = PairAggregator()
+    for pair, result in pair_results.items():
+        aggregator.add(pair, result)
+    return aggregator.metrics()
+
+
+def run_all(language_file, data_file, record_class, processes=32, extension_dir='Extension'):
+    return run_many({language_file: record_class}, data_file, processes, extension_dir,
+                    keep_results=False)[language_file].metrics()
 
 
 if __name__ == '__main__':
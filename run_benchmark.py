@@ -2,8 +2,11 @@ import argparse
 import glob
 import os
 import sys
-import pickle
-from run import run_all
+from framing import write_frame
+from journal import Journal
+from result_cache import ResultCache, result_key
+from results_store import RESULTS_DIR, ResultsWriter
+from run import aggregate, list_nodes, pair_schedule, result_parameters, run_many
 
 
 def main():
@@ -26,20 +29,78 @@ def main():
             class_name = sp2[1]
         record[sp1] = class_name
 
+    # results of an FD are reused as long as its language file, its Record class, the traces and the parameters are
+    # unchanged
+    directories = list_nodes(traces_dir)
+    parameters = result_parameters()
+    cache = None if args.no_cache else ResultCache(args.c)
+    keys = {}
     data = {}
-    for language, structure in record.items():
-        data[language] = run_all(language, traces_dir, structure, processes)
+    to_run = {}
+    # every pair result of the run, cached or not, is also written to a columnar table (see results_store.py), which
+    # leaves no table behind if anything below fails
+    with ResultsWriter(args.r) as results:
+        for language, structure in record.items():
+            keys[language] = result_key(language, structure, traces_dir, directories, extension_dir, parameters)
+            pair_results = cache.get(keys[language]) if cache else None
+            if pair_results is None:
+                to_run[language] = structure
+            else:
+                data[language] = aggregate(pair_results)
+                for pair, result in pair_results.items():
+                    results.append(language, parameters, pair, result)
+
+        # every finished task is checkpointed in the journal, with --resume the tasks found there are not run again
+        journal = Journal(args.j)
+        journaled = journal.load() if args.resume else {}
+        completed = {language: journaled.get(keys[language], {}) for language in to_run}
+        for language, pair_results in completed.items():
+            for pair, result in pair_results.items():
+                results.append(language, parameters, pair, result)
+
+        # progress is streamed to stdout as frames (see framing.py): one 'start' frame, one 'task' frame per finished
+        # (FD, pair), one 'fd' frame per finished FD and a final 'result' frame
+        out = sys.stdout.buffer
+        pairs = len(pair_schedule(traces_dir, directories)[0])  # without the pairs that received nothing
+        total = len(to_run) * pairs - sum(map(len, completed.values()))
+        write_frame(out, {'type': 'start', 'fds': list(record), 'total': total})
+        for language in data:
+            write_frame(out, {'type': 'fd', 'fd': language, 'metrics': data[language], 'cached': True})
+
+        def on_result(language, pair, result):
+            journal.append(keys[language], pair, result)
+            results.append(language, parameters, pair, result)
+            write_frame(out, {'type': 'task', 'fd': language, 'pair': pair, 'metrics': result[:5],
+                              'user_cpu': result[5], 'system_cpu': result[6], 'wall_time': result[7],
+                              'wrong_count': result[8]})
+
+        def on_fd_complete(language, aggregator):
+            if cache:
+                cache.put(keys[language], aggregator.pairs)
+            data[language] = aggregator.metrics()
+            frame = {'type': 'fd', 'fd': language, 'metrics': data[language], 'cached': False}
+            if args.quantiles:
+                frame['quantiles'] = aggregator.quantiles()
+            write_frame(out, frame)
+
+        # all the FDs that are not cached share one pool and one task schedule, the results of every pair are only kept
+        # when they are cached, otherwise they are folded into the metrics as they arrive
+        # the journal only keeps the entries of the FDs run now, so it does not grow with every run the GUI resumes
+        with journal.open(resume=args.resume, keep={keys[language] for language in to_run}):
+            run_many(to_run, traces_dir, int(processes), extension_dir, on_fd_complete, on_result, completed,
+                     args.s or None, keep_results=cache is not None, sketch=args.quantiles)
+    data = {language: data[language] for language in record}
 
     # Output:
     # Data must look like this!
     # {fd_name: (detection time, detection time std, pa, pa std, mistake duration, cpu, memory)}
     # data = {"accural": (105.74858808928572, 1.6750364820071866, 0.9979379611895526, 0.0008348593499185055,
-    #                     9364.899149998326, 0.6029575892857143, 110.89264787946429),
+    #                     9364.899149998326, 0.5924918654, 0.0449411773),
     #         "bertier": (100.91581011049107, 1.059675334140229, 0.9112516167575638, 0.02535474631119393,
-    #                     644043.3404513125, 0.375, 82.63825334821429),
+    #                     644043.3404513125, 0.4372791235, 0.0448862712),
     #         "chen": (100.09092747600445, 0.9009301070789003, 0.7423359876953095, 0.08329813139516726,
-    #                  2353438.4988998906, 0.294921875, 82.54171316964286)}
-    pickle.dump(data, sys.stdout.buffer)  # Must include this line!
+    #                  2353438.4988998906, 0.3027926378, 0.0449030558)}
+    write_frame(out, {'type': 'result', 'data': data})  # Must include this line!
 
 
 if __name__ == '__main__':
@@ -49,5 +110,15 @@ if __name__ == '__main__':
     parser.add_argument("-E", default=os.path.join(cwd, "Extension"), help="Directory to Extension folder")
     # parser.add_argument("-R", default=os.path.join(cwd, "Extension\\record.py"), help="Path to Record file")
     parser.add_argument("-p", default=32, help="Number of processes used to do benchmark")
+    parser.add_argument("-c", default=os.path.join(cwd, ".benchmark_cache"), help="Directory to result cache folder")
+    parser.add_argument("--no-cache", action="store_true", help="Always run the benchmark, ignoring cached results")
+    parser.add_argument("-s", type=int, default=0,
+                        help="Stream traces to the detectors in chunks of this many heartbeats (0 loads them whole)")
+    parser.add_argument("-j", default=os.path.join(cwd, ".benchmark_journal"), help="Path to checkpoint journal file")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the tasks already in the journal of a previous (interrupted) run")
+    parser.add_argument("-r", default=os.path.join(cwd, RESULTS_DIR), help="Directory to per-pair results folder")
+    parser.add_argument("--quantiles", action="store_true",
+                        help="Also estimate the quantiles of every metric over the pairs (in the 'fd' frames)")
     args = parser.parse_args()
     main()
@@ -0,0 +1,206 @@
+import math
+
+import numpy as np
+
+
+class RunningStats:
+    """
+    This class is used to fold values one by one into their count, mean and variance with Welford's algorithm, in
+    constant memory and without the cancellation of the sum of squares formula.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of the squared differences to the mean
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """
+        This method is used to fold the values of another RunningStats into this one (Chan et al.).
+
+        Args:
+            other (RunningStats): stats of other values
+
+        Returns:
+            None
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        # population variance, as np.var
+        return self.m2 / self.count if self.count > 0 else float('nan')
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class QuantileSketch:
+    """
+    This class is used to estimate the quantiles of a stream of values in bounded memory, with a relative error of at
+    most relative_accuracy (the DDSketch scheme): every value is counted in a logarithmic bucket, and a quantile is the
+    middle of the bucket holding its rank. The number of buckets only grows with the logarithm of the range of the
+    values, e.g. about 2800 buckets cover 1e-9 to 1e15 at 1 %.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}  # bucket index: count
+        self.negative = {}  # bucket index of the absolute value: count
+        self.zero = 0
+        self.count = 0
+
+    def _bucket(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def add(self, value):
+        if not math.isfinite(value):
+            return
+        if value > 0:
+            bucket = self._bucket(value)
+            self.positive[bucket] = self.positive.get(bucket, 0) + 1
+        elif value < 0:
+            bucket = self._bucket(-value)
+            self.negative[bucket] = self.negative.get(bucket, 0) + 1
+        else:
+            self.zero += 1
+        self.count += 1
+
+    def add_array(self, values):
+        """
+        This method is used to add many values at once, bucketed with array operations.
+
+        Args:
+            values (np.array): the values
+
+        Returns:
+            None
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        for store, part in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            buckets, counts = np.unique(np.ceil(np.log(part) / self.log_gamma).astype(np.int64), return_counts=True)
+            for bucket, count in zip(buckets.tolist(), counts.tolist()):
+                store[bucket] = store.get(bucket, 0) + count
+        self.zero += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+
+    def merge(self, other):
+        for bucket, count in other.positive.items():
+            self.positive[bucket] = self.positive.get(bucket, 0) + count
+        for bucket, count in other.negative.items():
+            self.negative[bucket] = self.negative.get(bucket, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+
+    def _value(self, bucket):
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def quantile(self, q):
+        """
+        This method is used to estimate a quantile.
+
+        Args:
+            q (float): quantile, between 0 and 1
+
+        Returns:
+            float: the estimate, nan if no value was added
+        """
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.negative, reverse=True):
+            seen += self.negative[bucket]
+            if seen > rank:
+                return -self._value(bucket)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.positive):
+            seen += self.positive[bucket]
+            if seen > rank:
+                return self._value(bucket)
+        return self._value(max(self.positive))
+
+
+class PairAggregator:
+    """
+    This class is used to reduce the results of the (receiver, sender) pairs of an FD into its metrics as the results
+    arrive, with one RunningStats (and optionally one QuantileSketch) per metric, so the memory does not depend on the
+    number of pairs unless keep_pairs asks to keep the results themselves (e.g. to store them in the result cache).
+    """
+
+    METRICS = ('detection_time', 'pa', 'mistake_duration', 'cpu', 'memory')
+
+    def __init__(self, keep_pairs=False, sketch=False):
+        self.stats = {metric: RunningStats() for metric in self.METRICS}
+        self.sketches = {metric: QuantileSketch() for metric in self.METRICS} if sketch else None
+        self.pairs = {} if keep_pairs else None
+        self.count = 0
+
+    def add(self, pair, result):
+        """
+        This method is used to fold the result of one pair.
+
+        Args:
+            pair (tuple): (receiver folder, sender folder)
+            result (tuple): tuple returned by run.run
+
+        Returns:
+            None
+        """
+        # times in ms, as aggregate always reported them
+        values = (result[1] / 1000000, result[2], result[0] / 1000000, result[3], result[4])
+        for metric, value in zip(self.METRICS, values):
+            self.stats[metric].add(value)
+            if self.sketches is not None:
+                self.sketches[metric].add(value)
+        if self.pairs is not None:
+            self.pairs[pair] = result
+        self.count += 1
+
+    def metrics(self):
+        """
+        This method is used to get the metrics of the FD.
+
+        Args:
+            None
+
+        Returns:
+            tuple: (detection time, detection time std, pa, pa std, mistake duration, cpu, memory), times in ms, all nan
+            if no pair was added (as np.mean and np.std of nothing)
+        """
+        if self.count == 0:
+            return (float('nan'),) * 7
+        stats = self.stats
+        return stats['detection_time'].mean, stats['detection_time'].std, stats['pa'].mean, stats['pa'].std, \
+            stats['mistake_duration'].mean, stats['cpu'].mean, stats['memory'].mean
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        """
+        This method is used to get quantiles of every metric over the pairs.
+
+        Args:
+            qs (tuple): quantiles, between 0 and 1
+
+        Returns:
+            dict: {metric: {quantile: estimate}}, empty if the aggregator has no sketch
+        """
+        if self.sketches is None:
+            return {}
+        return {metric: {q: sketch.quantile(q) for q in qs} for metric, sketch in self.sketches.items()}
@@ -0,0 +1,244 @@
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from run import DELTA, list_nodes
+from trace_store import TRACE_FILE, StoreWriter
+
+START = 2439202316247486  # first send time of the PlanetLab traces, in ns, so synthetic timestamps look the same
+DELAY_DISTRIBUTIONS = ('normal', 'pareto', 'fitted')
+
+
+def fit_delays(data_file, period=DELTA, max_rows=1000000):
+    """
+    This function is used to collect the delay distribution of real traces. The clocks of the sender and the
+    receiver are not synchronized, so the delay of every heartbeat is measured relative to the fastest one of its
+    (receiver, sender) pair: its arrival time minus numseq * period, minus the minimum of that over the pair.
+
+    Args:
+        data_file (str): path to a traces folder whose nodes have a trace.csv
+        period (float): sending interval of the heartbeats, in ns
+        max_rows (int): number of rows read from every trace.csv
+
+    Returns:
+        np.array: relative delays in ns, to be resampled
+    """
+    samples = []
+    for i in list_nodes(data_file):
+        csv_path = os.path.join(data_file, i, TRACE_FILE)
+        if not os.path.exists(csv_path):
+            continue
+        df = pd.read_csv(csv_path, usecols=['site', 'numseq', 'timestamp_receive'], nrows=max_rows)
+        residual = df['timestamp_receive'].to_numpy(np.int64) - np.round(df['numseq'].to_numpy() * period) \
+            .astype(np.int64)
+        residual = pd.Series(residual)
+        samples.append((residual - residual.groupby(df['site'].to_numpy()).transform('min')).to_numpy())
+    if not samples:
+        raise FileNotFoundError('no {} found in {}'.format(TRACE_FILE, data_file))
+    return np.concatenate(samples)
+
+
+class TraceModel:
+    """
+    This class is used to describe how the synthetic heartbeats of a (receiver, sender) pair are sent, delayed, lost
+    and timestamped. All times are in ns.
+
+    Every sender sends one heartbeat every period to every other node. A heartbeat is delayed by a sample of the delay
+    distribution: 'normal' (delay_mean, delay_std, truncated at 0), 'pareto' (delay_mean is the minimum delay and
+    pareto_shape the tail index) or 'fitted' (resampled from fitted_delays, see fit_delays). It is lost with probability
+    loss, and in addition during loss bursts: a burst starts after each heartbeat with probability burst_rate and lasts
+    burst_length heartbeats on average. The receiver timestamps it with its own clock, which runs at (1 + drift) times
+    the true rate, drift being drawn per node from a normal distribution of standard deviation drift_ppm * 1e-6.
+
+    A fraction crash of the nodes crashes at a random time during the middle 80 % of the run: they neither send nor
+    receive anything afterwards.
+    """
+
+    def __init__(self, period=DELTA, delay='normal', delay_mean=5e6, delay_std=3e5, pareto_shape=2.5,
+                 fitted_delays=None, loss=0.0, burst_rate=0.0, burst_length=10.0, drift_ppm=0.0, crash=0.0):
+        if delay not in DELAY_DISTRIBUTIONS:
+            raise ValueError('unknown delay distribution {}, expected one of {}'.format(delay, DELAY_DISTRIBUTIONS))
+        if delay == 'fitted' and fitted_delays is None:
+            raise ValueError("the 'fitted' delay distribution needs fitted_delays")
+        self.period = int(period)
+        self.delay = delay
+        self.delay_mean = delay_mean
+        self.delay_std = delay_std
+        self.pareto_shape = pareto_shape
+        self.fitted_delays = fitted_delays
+        self.loss = loss
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self.drift_ppm = drift_ppm
+        self.crash = crash
+
+    def delays(self, rng, size):
+        """
+        This method is used to draw the delays of heartbeats.
+
+        Args:
+            rng (np.random.Generator): random generator
+            size (int): number of heartbeats
+
+        Returns:
+            np.array: delays in ns (int64)
+        """
+        if self.delay == 'normal':
+            delays = np.maximum(rng.normal(self.delay_mean, self.delay_std, size), 0)
+        elif self.delay == 'pareto':
+            delays = self.delay_mean * (1 + rng.pareto(self.pareto_shape, size))
+        else:
+            delays = self.fitted_delays[rng.integers(0, len(self.fitted_delays), size)]
+        return delays.astype(np.int64)
+
+    def received(self, rng, size, in_burst):
+        """
+        This method is used to draw which heartbeats are not lost. The bursts follow a two-state (Gilbert) Markov chain,
+        whose alternating runs of good and bad states have geometric lengths, so the chain can be drawn run by run
+        instead of heartbeat by heartbeat, and continued from in_burst at the next call.
+
+        Args:
+            rng (np.random.Generator): random generator
+            size (int): number of heartbeats
+            in_burst (bool): whether the previous heartbeat was in a loss burst
+
+        Returns:
+            tuple: (np.array of bool, True where the heartbeat is received; whether the last heartbeat is in a burst)
+        """
+        received = rng.random(size) >= self.loss if self.loss > 0 else np.ones(size, dtype=bool)
+        if self.burst_rate <= 0 or size == 0:
+            return received, in_burst
+        runs = []
+        total = 0
+        state = in_burst
+        while total < size:
+            count = max(16, int(2 * size * self.burst_rate) + 1)
+            good = rng.geometric(self.burst_rate, count)
+            bad = rng.geometric(1 / self.burst_length, count) if self.burst_length > 1 else np.ones(count, np.int64)
+            lengths = np.column_stack((bad, good) if state else (good, bad)).ravel()
+            runs.append(lengths)
+            total += lengths.sum()
+        lengths = np.concatenate(runs)
+        states = np.resize(np.array([state, not state]), len(lengths))
+        burst = np.repeat(states, lengths)[:size]
+        return received & ~burst, bool(burst[-1])
+
+
+def _node_clock(model, rng, nodes, duration):
+    # local clock offset and drift, and crash time (or None), of every node
+    offset = rng.integers(0, model.period, nodes)
+    drift = rng.normal(0, model.drift_ppm * 1e-6, nodes) if model.drift_ppm > 0 else np.zeros(nodes)
+    crash_at = [None] * nodes
+    for node in rng.choice(nodes, int(round(model.crash * nodes)), replace=False):
+        crash_at[node] = START + int((0.1 + 0.8 * rng.random()) * duration)
+    return offset, drift, crash_at
+
+
+def synthesize_pair(model, rng, heartbeats, chunk_size, sender_start, sender_crash, receiver_offset, receiver_drift,
+                    receiver_crash):
+    """
+    This function is used to generate the arrival times of the heartbeats of one sender at one receiver, chunk by
+    chunk. The heartbeats are sorted by arrival inside every chunk, so the ones delayed by more than a chunk of
+    periods are not reordered with the next chunk.
+
+    Args:
+        model (TraceModel): how the heartbeats are sent, delayed and lost
+        rng (np.random.Generator): random generator of the pair
+        heartbeats (int): number of heartbeats sent by the sender if it does not crash
+        chunk_size (int): number of heartbeats generated at once
+        sender_start (int): true time of the first heartbeat
+        sender_crash (int): true crash time of the sender, None if it does not crash
+        receiver_offset (int): offset of the receiver clock
+        receiver_drift (float): drift of the receiver clock
+        receiver_crash (int): true crash time of the receiver, None if it does not crash
+
+    Returns:
+        generator: np.array chunks of arrival times in the receiver clock
+    """
+    if sender_crash is not None:
+        heartbeats = min(heartbeats, max(0, -(-(sender_crash - sender_start) // model.period)))
+    in_burst = False
+    for start in range(0, heartbeats, chunk_size):
+        sequence = np.arange(start, min(start + chunk_size, heartbeats), dtype=np.int64)
+        arrival = sender_start + sequence * model.period + model.delays(rng, len(sequence))
+        received, in_burst = model.received(rng, len(sequence), in_burst)
+        arrival = np.sort(arrival[received])
+        if receiver_crash is not None:
+            arrival = arrival[:np.searchsorted(arrival, receiver_crash)]
+        local = arrival + receiver_offset + np.round((arrival - START) * receiver_drift).astype(np.int64)
+        yield local
+        if receiver_crash is not None and len(arrival) < np.count_nonzero(received):
+            return
+
+
+def _synthesize_node(task):
+    out_dir, receiver, nodes, heartbeats, model, chunk_size, seed, clocks = task
+    offset, drift, crash_at = clocks
+    node_path = os.path.join(out_dir, 'Node{}'.format(receiver))
+    with StoreWriter(node_path) as writer:
+        for sender in range(nodes):
+            if sender == receiver:
+                continue
+            rng = np.random.default_rng([seed, receiver, sender])
+            for chunk in synthesize_pair(model, rng, heartbeats, chunk_size, START + offset[sender],
+                                         crash_at[sender], offset[receiver], drift[receiver], crash_at[receiver]):
+                writer.append(sender, chunk)
+    return receiver
+
+
+def synthesize(out_dir, nodes=8, heartbeats=100000, model=None, seed=0, chunk_size=1 << 20, processes=None):
+    """
+    This function is used to generate a synthetic traces folder with the same layout as the real one (Node0 ..
+    Node{nodes - 1}), which run.run_all and run_benchmark.py walk like any other. The traces are written straight into
+    the binary store of every node (see trace_store.py), chunk by chunk and one node per pool worker, without a
+    trace.csv.
+
+    Args:
+        out_dir (str): path to the traces folder to create
+        nodes (int): number of nodes, every node sends to and receives from every other node
+        heartbeats (int): number of heartbeats sent by every node to every other node (unless it crashes)
+        model (TraceModel): how the heartbeats are sent, delayed, lost and timestamped, TraceModel() by default
+        seed (int): seed of the random generators, the same seed gives the same traces
+        chunk_size (int): number of heartbeats generated at once per pair
+        processes (int): number of processes of the pool, os.cpu_count() by default
+
+    Returns:
+        None
+    """
+    model = model or TraceModel()
+    clocks = _node_clock(model, np.random.default_rng([seed, nodes]), nodes, heartbeats * model.period)
+    tasks = [(out_dir, receiver, nodes, heartbeats, model, chunk_size, seed, clocks) for receiver in range(nodes)]
+    os.makedirs(out_dir, exist_ok=True)
+    with multiprocessing.Pool(processes=processes) as pool:
+        for _ in pool.imap_unordered(_synthesize_node, tasks):
+            pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", required=True, help="Directory of the traces folder to create")
+    parser.add_argument("-n", type=int, default=8, help="Number of nodes")
+    parser.add_argument("-H", type=int, default=100000, help="Number of heartbeats per (receiver, sender) pair")
+    parser.add_argument("--period", type=float, default=DELTA, help="Sending interval in ns")
+    parser.add_argument("--delay", choices=DELAY_DISTRIBUTIONS, default='normal', help="Delay distribution")
+    parser.add_argument("--delay-mean", type=float, default=5e6, help="Mean (normal) or minimum (pareto) delay in ns")
+    parser.add_argument("--delay-std", type=float, default=3e5, help="Standard deviation of the normal delay in ns")
+    parser.add_argument("--pareto-shape", type=float, default=2.5, help="Tail index of the pareto delay")
+    parser.add_argument("--fit", help="Traces folder (with trace.csv files) to fit the delays from")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability of losing a heartbeat")
+    parser.add_argument("--burst-rate", type=float, default=0.0, help="Probability of starting a loss burst")
+    parser.add_argument("--burst-length", type=float, default=10.0, help="Mean length of a loss burst in heartbeats")
+    parser.add_argument("--drift-ppm", type=float, default=0.0, help="Standard deviation of the clock drifts in ppm")
+    parser.add_argument("--crash", type=float, default=0.0, help="Fraction of the nodes that crash")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("-p", type=int, default=None, help="Number of processes")
+    args = parser.parse_args()
+
+    synthesize(args.o, args.n, args.H,
+               TraceModel(args.period, args.delay, args.delay_mean, args.delay_std, args.pareto_shape,
+                          fit_delays(args.fit, args.period) if args.fit else None, args.loss, args.burst_rate,
+                          args.burst_length, args.drift_ppm, args.crash),
+               args.seed, processes=args.p)
@@ -0,0 +1,522 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = '.trace_store'
+MANIFEST = 'manifest.json'
+TRACE_FILE = 'trace.csv'
+CSV_CHUNK_ROWS = 1 << 20  # rows of trace.csv parsed at once when building a store
+LOG_BLOCK_ROWS = 1 << 21  # lines of a raw PlanetLab log parsed at once
+# columns of every kind of raw PlanetLab log, see data/README-trace-files-explanation.txt
+LOG_COLUMNS = {'trace': ['site', 'numseq', 'timestamp_send', 'timestamp_receive', 'hops'],
+               'sent': ['site', 'numseq', 'timestamp_send'],
+               'sentinterval': ['numseq', 'timestamp_start_send', 'timestamp_end_send']}
+STREAM_CHUNK_SIZE = 1 << 16  # arrival times per chunk when streaming a pair from the store
+
+# where a 1-D array lies in a .npy file of a store, small enough to be sent to pool workers instead of the array
+ArrayHandle = namedtuple('ArrayHandle', ['path', 'offset', 'length', 'dtype'])
+
+
+def file_signature(path, digest=True):
+    """
+    This function is used to describe a source trace file so that the binary store built from it can be validated later.
+
+    Args:
+        path (str): path to the source file
+        digest (bool): whether to also compute the sha256 digest of the file content
+
+    Returns:
+        dict: the size, the modification time and (optionally) the content hash of the file
+    """
+    stat = os.stat(path)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    if digest:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        signature['sha256'] = sha.hexdigest()
+    return signature
+
+
+def _read_manifest(store_path):
+    try:
+        with open(os.path.join(store_path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(store_path, manifest):
+    tmp_path = os.path.join(store_path, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(store_path, MANIFEST))
+
+
+def is_valid(node_path):
+    """
+    This function is used to check whether the binary store of a node is up to date with its trace.csv. A store whose
+    size and mtime match is trusted directly; if only the mtime changed (e.g. the file was copied), the content hash
+    decides and the manifest is refreshed. A store ingested from a raw log that is not on disk anymore is used as is.
+
+    Args:
+        node_path (str): path to the node directory (e.g. data/Node0)
+
+    Returns:
+        bool: True if the store can be used without parsing the csv file
+    """
+    store_path = os.path.join(node_path, STORE_DIR)
+    manifest = _read_manifest(store_path)
+    if manifest is None:
+        return False
+    source = manifest.get('source')
+    if source is None:
+        # the store was written directly (no csv behind it), it is the trace itself
+        return True
+    # the source is the trace.csv of the node, or the raw log named by 'file' (see ingest.py)
+    csv_path = source.get('file') or os.path.join(node_path, TRACE_FILE)
+    if not os.path.exists(csv_path):
+        # a raw log that was moved or deleted after ingest leaves the store as the only copy of the trace
+        return 'file' in source
+    current = file_signature(csv_path, digest=False)
+    if current['size'] != source['size']:
+        return False
+    if current['mtime'] == source['mtime']:
+        return True
+    current = file_signature(csv_path)
+    if current['sha256'] != source['sha256']:
+        return False
+    if 'file' in source:
+        current['file'] = source['file']
+    manifest['source'] = current
+    _write_manifest(store_path, manifest)
+    return True
+
+
+def write_store(node_path, arrays, source=None):
+    """
+    This function is used to write per-sender arrival time arrays of a node into its binary store.
+
+    Args:
+        node_path (str): path to the node directory
+        arrays (dict): {sender site (int): np.array of arrival times}
+        source (dict): signature of the file the arrays come from, None if the store is the only copy of the trace
+
+    Returns:
+        None
+    """
+    store_path = os.path.join(node_path, STORE_DIR)
+    os.makedirs(store_path, exist_ok=True)
+    senders = {}
+    for site, array in arrays.items():
+        file_name = 'site{}.npy'.format(int(site))
+        np.save(os.path.join(store_path, file_name), np.ascontiguousarray(array, dtype=np.int64))
+        senders[str(int(site))] = file_name
+    _write_manifest(store_path, {'source': source, 'senders': senders})
+
+
+def split_by_site(site, timestamp):
+    """
+    This function is used to split the rows of a trace into one arrival time array per sender site, with a single
+    stable sort so that the receiving order inside every sender is kept.
+
+    Args:
+        site (np.array): sender site of every row
+        timestamp (np.array): arrival time of every row
+
+    Returns:
+        dict: {sender site (int): np.array of arrival times}
+    """
+    order = np.argsort(site, kind='stable')
+    site = site[order]
+    timestamp = timestamp[order]
+    boundaries = np.flatnonzero(np.diff(site)) + 1
+    starts = np.concatenate(([0], boundaries))
+    arrays = {}
+    for start, array in zip(starts, np.split(timestamp, boundaries)):
+        if len(array) > 0:
+            arrays[int(site[start])] = array
+    return arrays
+
+
+def read_trace(csv_path):
+    """
+    This function is used to read a trace.csv file once and split it into one arrival time array per sender site. Only
+    the 'site' and 'timestamp_receive' columns are parsed.
+
+    Args:
+        csv_path (str): path to the trace.csv file
+
+    Returns:
+        dict: {sender site (int): np.array of arrival times}
+    """
+    df = pd.read_csv(csv_path, usecols=['site', 'timestamp_receive'],
+                     dtype={'site': np.int16, 'timestamp_receive': np.int64})
+    return split_by_site(df['site'].to_numpy(), df['timestamp_receive'].to_numpy())
+
+
+class ArrayWriter:
+    """
+    This class is used to write a .npy file (int64 by default) incrementally: rows are appended block by block, and
+    the header, reserved up front with a fixed size, only gets the length of the array once the writer is closed, so
+    the memory used does not depend on the size of the array. The file is written under a temporary name and renamed
+    on close.
+    """
+
+    HEADER_SIZE = 128  # bytes of the reserved .npy (version 1.0) header, enough for any 1-D or 2-D shape
+
+    def __init__(self, path, columns=None, dtype=np.int64):
+        self.path = path
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(self._header(0))
+
+    def _header(self, length):
+        shape = (length,) if self.columns is None else (length, self.columns)
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                       'shape': shape})
+        header = header.ljust(self.HEADER_SIZE - len(np.lib.format.MAGIC_PREFIX) - 4 - 1) + '\n'
+        return np.lib.format.magic(1, 0) + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+    def append(self, array):
+        """
+        This method is used to append values (or rows of columns values if the array has columns).
+
+        Args:
+            array (np.array): values to append
+
+        Returns:
+            None
+        """
+        np.ascontiguousarray(array, dtype=self.dtype).tofile(self.file)
+
+    def close(self):
+        row_size = self.dtype.itemsize * (self.columns or 1)
+        length = (self.file.tell() - self.HEADER_SIZE) // row_size
+        self.file.seek(0)
+        self.file.write(self._header(length))
+        self.file.close()
+        os.replace(self.file.name, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.file.name)
+
+
+class StoreWriter:
+    """
+    This class is used to write the binary store of a node incrementally: the arrival times of every sender are
+    appended chunk by chunk to their .npy file with an ArrayWriter, so the memory used does not depend on the size of
+    the trace. The manifest is written last, so an interrupted writer leaves no valid store behind. It can be used as a
+    context manager.
+    """
+
+    def __init__(self, node_path, source=None):
+        self.store_path = os.path.join(node_path, STORE_DIR)
+        self.source = source
+        self.writers = {}
+        os.makedirs(self.store_path, exist_ok=True)
+        try:
+            os.remove(os.path.join(self.store_path, MANIFEST))
+        except FileNotFoundError:
+            pass
+
+    def append(self, site, array):
+        """
+        This method is used to append arrival times received from a sender.
+
+        Args:
+            site (int): the sending site
+            array (np.array): arrival times, in receiving order
+
+        Returns:
+            None
+        """
+        site = int(site)
+        if site not in self.writers:
+            self.writers[site] = ArrayWriter(os.path.join(self.store_path, 'site{}.npy'.format(site)))
+        self.writers[site].append(array)
+
+    def close(self):
+        """
+        This method is used to complete the headers of the arrays and write the manifest.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        senders = {}
+        for site, writer in self.writers.items():
+            writer.close()
+            senders[str(site)] = os.path.basename(writer.path)
+        self.writers = {}
+        _write_manifest(self.store_path, {'source': self.source, 'senders': senders})
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.abort()
+        self.writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def build_store(node_path, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    This function is used to parse the trace.csv of a node and write one arrival time array per sender site. The csv
+    file is parsed chunk_rows rows at a time and written with a StoreWriter, so traces larger than the memory can be
+    converted. A store ingested from a raw traceX.log (see ingest.py) is ingested again from that log instead.
+
+    Args:
+        node_path (str): path to the node directory
+        chunk_rows (int): number of rows parsed at once
+
+    Returns:
+        None
+    """
+    manifest = _read_manifest(os.path.join(node_path, STORE_DIR))
+    source = manifest.get('source') if manifest else None
+    if source and source.get('file'):
+        # the store was ingested from a raw traceX.log
+        ingest_trace_log(source['file'], node_path)
+        return
+    csv_path = os.path.join(node_path, TRACE_FILE)
+    with StoreWriter(node_path, file_signature(csv_path)) as writer:
+        for df in pd.read_csv(csv_path, usecols=['site', 'timestamp_receive'], chunksize=chunk_rows,
+                              dtype={'site': np.int16, 'timestamp_receive': np.int64}):
+            for site, array in split_by_site(df['site'].to_numpy(), df['timestamp_receive'].to_numpy()).items():
+                writer.append(site, array)
+
+
+def read_log(log_path, kind, block_rows=LOG_BLOCK_ROWS):
+    """
+    This function is used to parse a whitespace-delimited PlanetLab log in blocks of lines, with the C parser of
+    pandas, into int64 arrays.
+
+    Args:
+        log_path (str): path to the log file
+        kind (str): 'trace', 'sent' or 'sentinterval'
+        block_rows (int): number of lines parsed at once
+
+    Returns:
+        generator: (block_rows, len(LOG_COLUMNS[kind])) int64 np.array blocks, in the order of the file
+    """
+    for df in pd.read_csv(log_path, sep=r'\s+', header=None, names=LOG_COLUMNS[kind], dtype=np.int64,
+                          chunksize=block_rows):
+        yield df.to_numpy()
+
+
+def ingest_trace_log(log_path, node_path, block_rows=LOG_BLOCK_ROWS):
+    """
+    This function is used to write the receptions of a traceX.log into the binary store of node X, like build_store
+    does for a trace.csv. The manifest names the log as the source of the store, so the store is ingested again if the
+    log changes, and kept as the trace if the log is moved or deleted.
+
+    Args:
+        log_path (str): path to the traceX.log file
+        node_path (str): path to the node directory (e.g. data/NodeX)
+        block_rows (int): number of lines parsed at once
+
+    Returns:
+        None
+    """
+    log_path = os.path.abspath(log_path)
+    source = file_signature(log_path)
+    source['file'] = log_path
+    site, timestamp_receive = LOG_COLUMNS['trace'].index('site'), LOG_COLUMNS['trace'].index('timestamp_receive')
+    with StoreWriter(node_path, source) as writer:
+        for block in read_log(log_path, 'trace', block_rows):
+            for sender, array in split_by_site(block[:, site], block[:, timestamp_receive]).items():
+                writer.append(sender, array)
+
+
+def load_node(node_path):
+    """
+    This function is used to get every sender's arrival times received by a node. The csv file is only parsed when the
+    binary store is missing or out of date, otherwise the arrays are memory-mapped from disk.
+
+    Args:
+        node_path (str): path to the node directory
+
+    Returns:
+        dict: {sender site (int): np.array of arrival times}
+    """
+    if not is_valid(node_path):
+        build_store(node_path)
+    store_path = os.path.join(node_path, STORE_DIR)
+    manifest = _read_manifest(store_path)
+    arrays = {}
+    for site, file_name in manifest['senders'].items():
+        arrays[int(site)] = np.load(os.path.join(store_path, file_name), mmap_mode='r')
+    return arrays
+
+
+def node_fingerprint(node_path):
+    """
+    This function is used to identify the content of a node's trace without reading it again: the content hash of its
+    trace.csv, or, for a store written directly, the signatures of the manifest and of the arrays.
+
+    Args:
+        node_path (str): path to the node directory
+
+    Returns:
+        str: a hex digest that changes whenever the trace of the node changes
+    """
+    if not is_valid(node_path):
+        build_store(node_path)
+    store_path = os.path.join(node_path, STORE_DIR)
+    manifest = _read_manifest(store_path)
+    if manifest['source'] is not None:
+        return manifest['source']['sha256']
+    sha = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode())
+    for file_name in sorted(manifest['senders'].values()):
+        sha.update(json.dumps(file_signature(os.path.join(store_path, file_name), digest=False)).encode())
+    return sha.hexdigest()
+
+
+def load_pair(node_path, site):
+    """
+    This function is used to get the arrival times of the heartbeats sent by a site and received by a node.
+
+    Args:
+        node_path (str): path to the receiving node directory
+        site (int): the sending site
+
+    Returns:
+        np.array: the arrival times, empty if the node never received anything from the site
+    """
+    arrays = load_node(node_path)
+    if site in arrays:
+        return arrays[site]
+    return np.array([], dtype=np.int64)
+
+
+def _read_header(f):
+    # shape and dtype of a .npy file, leaves f at the start of the data
+    if np.lib.format.read_magic(f) == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def pair_handles(node_path):
+    """
+    This function is used to get a handle on every sender's arrival times received by a node, instead of the arrays
+    themselves (see open_array).
+
+    Args:
+        node_path (str): path to the node directory
+
+    Returns:
+        dict: {sender site (int): ArrayHandle}
+    """
+    if not is_valid(node_path):
+        build_store(node_path)
+    store_path = os.path.join(node_path, STORE_DIR)
+    handles = {}
+    for site, file_name in _read_manifest(store_path)['senders'].items():
+        path = os.path.abspath(os.path.join(store_path, file_name))
+        with open(path, 'rb') as f:
+            shape, dtype = _read_header(f)
+            handles[int(site)] = ArrayHandle(path, f.tell(), shape[0], dtype.str)
+    return handles
+
+
+def pair_handle(node_path, site):
+    """
+    This function is used to get a handle on the arrival times of one sender received by a node, reading only the
+    manifest and the header of that sender's array. Unlike pair_handles, it does not check that the store is up to
+    date, so it is meant for stores already checked (e.g. by pair_handles).
+
+    Args:
+        node_path (str): path to the receiving node directory
+        site (int): the sending site
+
+    Returns:
+        ArrayHandle: where the arrival times lie, of length 0 if the node never received anything from the site
+    """
+    store_path = os.path.join(node_path, STORE_DIR)
+    file_name = _read_manifest(store_path)['senders'].get(str(int(site)))
+    if file_name is None:
+        return ArrayHandle(None, 0, 0, np.dtype(np.int64).str)
+    path = os.path.abspath(os.path.join(store_path, file_name))
+    with open(path, 'rb') as f:
+        shape, dtype = _read_header(f)
+        return ArrayHandle(path, f.tell(), shape[0], dtype.str)
+
+
+def open_array(handle):
+    """
+    This function is used to read the array of a handle without copying it: the file is memory-mapped, so every process
+    opening the same handle shares the pages of the OS file cache. The result is a plain np.ndarray view (not an
+    np.memmap, whose Python-level indexing would slow down the element by element loops of the detectors).
+
+    Args:
+        handle (ArrayHandle): where the array lies
+
+    Returns:
+        np.array: read-only view of the array
+    """
+    if handle.length == 0:
+        return np.array([], dtype=handle.dtype)
+    return np.memmap(handle.path, dtype=handle.dtype, mode='r', offset=handle.offset,
+                     shape=(handle.length,)).view(np.ndarray)
+
+
+def iter_pair_chunks(node_path, site, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This function is used to stream the arrival times of the heartbeats sent by a site and received by a node from the
+    binary store, chunk_size arrival times at a time, without mapping or loading the whole array.
+
+    Args:
+        node_path (str): path to the receiving node directory
+        site (int): the sending site
+        chunk_size (int): number of arrival times per chunk
+
+    Returns:
+        generator: np.array chunks of arrival times, none if the node never received anything from the site
+    """
+    if not is_valid(node_path):
+        build_store(node_path)
+    store_path = os.path.join(node_path, STORE_DIR)
+    file_name = _read_manifest(store_path)['senders'].get(str(int(site)))
+    if file_name is None:
+        return
+    with open(os.path.join(store_path, file_name), 'rb') as f:
+        shape, dtype = _read_header(f)
+        for start in range(0, shape[0], chunk_size):
+            yield np.fromfile(f, dtype=dtype, count=min(chunk_size, shape[0] - start))
+
+
+def load_table(node_path, name):
+    """
+    This function is used to get a table stored next to the arrival times of a node, e.g. the 'sent' and
+    'sentinterval' logs written by ingest.py.
+
+    Args:
+        node_path (str): path to the node directory
+        name (str): name of the table
+
+    Returns:
+        np.array: the memory-mapped (rows, columns) int64 table, None if the node has no such table
+    """
+    path = os.path.join(node_path, STORE_DIR, '{}.npy'.format(name))
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
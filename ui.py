@@ -8,11 +8,13 @@ from datetime import datetime
 import matplotlib.pyplot as plt
 import pandas as pd
 from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal, QObject
+from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtWidgets import QMainWindow, QApplication, QPushButton, QFileDialog, QMessageBox, QDialog, QWidget, \
-    QVBoxLayout, QHBoxLayout, QLabel, QDialogButtonBox, QCheckBox, QRadioButton
+    QVBoxLayout, QHBoxLayout, QLabel, QDialogButtonBox, QCheckBox, QRadioButton, QGridLayout, QDoubleSpinBox
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 
-from benchmark import feed_to_visual
+from benchmark import DEFAULT_RANGES, DEFAULT_WEIGHTS, METRIC_NAMES, feed_to_visual, rank_stability, score_table
+from framing import read_frames
 
 
 class MainWindow(QMainWindow):
@@ -199,7 +201,11 @@ class MainWindow(QMainWindow):
         try:
             with open(self.score_file, "rb") as f:
                 data = pickle.load(f)
-            self.plot_window = PlotWindow(data, parent=self)
+            # score files also hold the raw metrics since the weights can be edited, older ones only the scores
+            if set(data) == {"scores", "metrics"}:
+                self.plot_window = PlotWindow(data["scores"], parent=self, metrics=data["metrics"])
+            else:
+                self.plot_window = PlotWindow(data, parent=self)
             self.plot_window.show()
         except Exception as e:
             self.msg_dialog.display_error(e)
@@ -243,6 +249,12 @@ class BenchmarkWindow(QWidget):
         self.main_label = QLabel("Running... 0")
         layout.addWidget(self.main_label)
 
+        self.progress_label = QLabel("Waiting for the benchmark to start...")
+        layout.addWidget(self.progress_label)
+
+        self.fd_label = QLabel("")  # scores of the FDs finished so far
+        layout.addWidget(self.fd_label)
+
         buttons_widgets = QWidget()
         buttons_layout = QHBoxLayout()
 
@@ -276,10 +288,15 @@ class BenchmarkWindow(QWidget):
         self.is_cancelled = False
         self.is_data_saved = False
         self.benchmark_score = {}  # also the input to visualization
+        self.benchmark_metrics = {}  # raw metrics of every FD, to score them again with other weights
+        self.completed_tasks = 0
+        self.total_tasks = None
         self.worker_thread = WorkerThread(parent=self)
         self.worker_thread.signals.finished.connect(self.on_thread_finish)
         self.worker_thread.signals.result.connect(self.handle_thread_result)
         self.worker_thread.signals.error.connect(self.handle_thread_error)
+        self.worker_thread.signals.progress.connect(self.handle_thread_progress)
+        self.worker_thread.signals.fd_result.connect(self.handle_thread_fd_result)
         self.worker_thread.start()
 
         layout.setSpacing(50)
@@ -289,11 +306,37 @@ class BenchmarkWindow(QWidget):
     def update_time_elapsed(self):
         self.time_elapsed += 1
         self.main_label.setText(f"Running... {self.time_elapsed}")
+        self.update_progress()
+
+    def update_progress(self):
+        if self.total_tasks is None:
+            return
+        text = f"Completed {self.completed_tasks}/{self.total_tasks} tasks"
+        if self.completed_tasks > 0 and self.time_elapsed > 0:
+            throughput = self.completed_tasks / self.time_elapsed
+            eta = (self.total_tasks - self.completed_tasks) / throughput
+            text += f", {throughput:.2f} tasks/s, ETA {eta:.0f} s"
+        self.progress_label.setText(text)
+
+    def handle_thread_progress(self, completed, total):
+        self.completed_tasks, self.total_tasks = completed, total
+        self.update_progress()
+
+    def handle_thread_fd_result(self, fd, score, metrics):
+        self.benchmark_score[fd] = score
+        self.benchmark_metrics[fd] = metrics
+        self.fd_label.setText("\n".join(f"{name}: {s['total']}" for name, s in self.benchmark_score.items()))
 
     def on_thread_finish(self):
         self.is_finished = True
         self.timer.stop()
-        if self.is_cancelled:
+        if self.is_cancelled and self.benchmark_score:
+            # keep the scores of the FDs that were already finished
+            self.main_label.setText(f"Benchmark cancelled. Scores of {len(self.benchmark_score)} FD(s) kept.")
+            self.is_cancelled = False
+            self.save_button.show()
+            self.plot_button.show()
+        elif self.is_cancelled:
             self.main_label.setText("Benchmark cancelled")
         else:
             self.main_label.setText(f"Finished. Benchmark score ready.")
@@ -326,7 +369,7 @@ class BenchmarkWindow(QWidget):
                                                    "MyData files (*.mydata)")
         if file_path:
             with open(file_path, "wb") as f:
-                pickle.dump(self.benchmark_score, f)
+                pickle.dump({"scores": self.benchmark_score, "metrics": self.benchmark_metrics}, f)
             self.is_data_saved = True
             self.parent.last_directory = os.path.dirname(file_path)
             self.parent.msg_dialog.display_message(f'Benchmark score saved as "{file_path}"', "Data saved")
@@ -336,7 +379,8 @@ class BenchmarkWindow(QWidget):
             self.msg_dialog.display_error("You can at most open one plot window at a time!")
             return
         data = self.benchmark_score
-        self.plot_window = PlotWindow(data, parent=self.parent)  # set parent for displaying messages
+        # set parent for displaying messages
+        self.plot_window = PlotWindow(data, parent=self.parent, metrics=self.benchmark_metrics)
         self.plot_window.show()
 
     def closeEvent(self, event):
@@ -407,6 +451,8 @@ class WorkerSignals(QObject):
     finished = pyqtSignal()
     result = pyqtSignal(object)
     error = pyqtSignal(object)
+    progress = pyqtSignal(int, int)  # completed tasks, total tasks
+    fd_result = pyqtSignal(str, object, object)  # FD name, its scores, its raw metrics
 
 
 class WorkerThread(QThread):
@@ -423,23 +469,39 @@ class WorkerThread(QThread):
         self.proc = subprocess.Popen(["python", "run_benchmark.py",
                                       "-t", self.parent.parent.traces_dir,
                                       "-E", self.parent.parent.extension_dir,
+                                      # journal entries are keyed by FD content, so a run cancelled in the quit
+                                      # window (or killed) always picks up where it stopped
+                                      "--resume",
                                       ],  # "-R", self.parent.parent.record_file
                                      stdout=subprocess.PIPE)
-        stdout, stderr = self.proc.communicate()
-        if self.proc.returncode == 0:
-            benchmark_data = pickle.loads(stdout)
-            benchmark_score = {}
-            for algo, data in benchmark_data.items():
-                feed_to_visual(algo, data, benchmark_score)
+        # run_benchmark.py streams frames (see framing.py), consume them as they arrive
+        benchmark_score = {}
+        completed, total = 0, 0
+        is_complete = False
+        for record in read_frames(self.proc.stdout):
+            if record['type'] == 'start':
+                total = record['total']
+                self.signals.progress.emit(completed, total)
+            elif record['type'] == 'task':
+                completed += 1
+                self.signals.progress.emit(completed, total)
+            elif record['type'] == 'fd':
+                feed_to_visual(record['fd'], record['metrics'], benchmark_score)
+                self.signals.fd_result.emit(record['fd'], benchmark_score[record['fd']], tuple(record['metrics']))
+            elif record['type'] == 'result':
+                is_complete = True
+        self.proc.wait()
+        if is_complete and self.proc.returncode == 0:
             self.signals.result.emit(benchmark_score)
-        elif self.proc.returncode != 777:  # 777 is the return code when user kills the process in quit window
-            self.signals.error.emit(stderr)
+        elif self.proc.returncode != 777 and not self.parent.is_cancelled:
+            # 777 is the return code when user kills the process in quit window
+            self.signals.error.emit(f"Benchmark process exited with code {self.proc.returncode}")
         self.signals.finished.emit()
 
 
 class PlotWindow(QWidget):
 
-    def __init__(self, data, parent=None):
+    def __init__(self, data, parent=None, metrics=None):
         super().__init__()
 
         self.setWindowTitle("Plot")
@@ -449,8 +511,11 @@ class PlotWindow(QWidget):
         # Attributes
         self.parent = parent
         self.data = data  # benchmark score
+        self.raw_metrics = metrics  # raw metrics of the FDs, None for score files without them
         self.failure_detectors = []  # check boxes
         self.metrics = []  # check boxes
+        self.weight_boxes = []  # spin boxes of the weight/range editor
+        self.range_boxes = []  # (scored 90 at, scored 60 at) spin boxes
 
         layout = QVBoxLayout()
 
@@ -515,6 +580,10 @@ class PlotWindow(QWidget):
         central_widget.setLayout(central_layout)
         layout.addWidget(central_widget)
 
+        # weights and ranges can only be edited when the raw metrics of every FD are known
+        if self.raw_metrics and set(self.raw_metrics) >= set(self.data):
+            layout.addWidget(self.create_score_editor())
+
         lower_widget = QWidget()
         lower_layout = QHBoxLayout()
         self.save_h_bar_chart_button = QPushButton("Save Figure")
@@ -535,6 +604,100 @@ class PlotWindow(QWidget):
         self.setLayout(layout)
         self.draw_and_redraw()
 
+    def create_score_editor(self):
+        editor_widget = QWidget()
+        editor_layout = QHBoxLayout()
+
+        grid_widget = QWidget()
+        grid = QGridLayout()
+        for column, header in enumerate(("Metric", "Weight", "Scored 90 at", "Scored 60 at")):
+            grid.addWidget(QLabel(header), 0, column)
+        for row, (name, weight, (best, worst)) in enumerate(zip(METRIC_NAMES, DEFAULT_WEIGHTS, DEFAULT_RANGES), 1):
+            grid.addWidget(QLabel(name), row, 0)
+            weight_box = QDoubleSpinBox()
+            weight_box.setRange(0, 1)
+            weight_box.setDecimals(3)
+            weight_box.setSingleStep(0.05)
+            weight_box.setValue(weight)
+            weight_box.valueChanged.connect(self.rescore)
+            self.weight_boxes.append(weight_box)
+            grid.addWidget(weight_box, row, 1)
+            range_boxes = []
+            for column, value in enumerate((best, worst), 2):
+                range_box = QDoubleSpinBox()
+                range_box.setRange(-1e12, 1e12)
+                range_box.setDecimals(4)
+                range_box.setSingleStep(abs(worst - best) / 20)
+                range_box.setValue(value)
+                range_box.valueChanged.connect(self.rescore)
+                range_boxes.append(range_box)
+                grid.addWidget(range_box, row, column)
+            self.range_boxes.append(range_boxes)
+        grid_widget.setLayout(grid)
+        editor_layout.addWidget(grid_widget)
+
+        button_widget = QWidget()
+        button_layout = QVBoxLayout()
+        self.weight_sum_label = QLabel("")
+        button_layout.addWidget(self.weight_sum_label)
+        reset_button = QPushButton("Reset weights and ranges")
+        reset_button.clicked.connect(self.reset_score_editor)
+        button_layout.addWidget(reset_button)
+        stability_button = QPushButton("Rank stability")
+        stability_button.clicked.connect(self.show_rank_stability)
+        button_layout.addWidget(stability_button)
+        button_widget.setLayout(button_layout)
+        editor_layout.addWidget(button_widget)
+
+        # probability of every rank under random weights, see benchmark.rank_stability
+        self.stability_label = QLabel("")
+        self.stability_label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        editor_layout.addWidget(self.stability_label)
+
+        editor_layout.setAlignment(Qt.AlignCenter)
+        editor_widget.setLayout(editor_layout)
+        self.update_weight_sum()
+        return editor_widget
+
+    def editor_values(self):
+        weights = tuple(box.value() for box in self.weight_boxes)
+        ranges = tuple((best.value(), worst.value()) for best, worst in self.range_boxes)
+        return weights, ranges
+
+    def update_weight_sum(self):
+        weights, _ = self.editor_values()
+        self.weight_sum_label.setText(f"Sum of weights: {sum(weights):.3f}")
+
+    def rescore(self):
+        # scoring is vectorized over the FDs (benchmark.score_table), so only the redraw takes time
+        self.update_weight_sum()
+        weights, ranges = self.editor_values()
+        if any(best == worst for best, worst in ranges):
+            return
+        self.data = score_table({fd: self.raw_metrics[fd] for fd in self.data}, weights, ranges)
+        self.stability_label.setText("")
+        self.draw_and_redraw()
+
+    def reset_score_editor(self):
+        for box, weight in zip(self.weight_boxes, DEFAULT_WEIGHTS):
+            box.blockSignals(True)
+            box.setValue(weight)
+            box.blockSignals(False)
+        for boxes, values in zip(self.range_boxes, DEFAULT_RANGES):
+            for box, value in zip(boxes, values):
+                box.blockSignals(True)
+                box.setValue(value)
+                box.blockSignals(False)
+        self.rescore()
+
+    def show_rank_stability(self):
+        weights, ranges = self.editor_values()
+        if any(best == worst for best, worst in ranges):
+            return
+        df = rank_stability({fd: self.raw_metrics[fd] for fd in self.data}, 10000, weights, ranges=ranges)
+        self.stability_label.setText("Ranks under 10000 random weightings\n" +
+                                     df.to_string(float_format=lambda x: f"{x:.3f}"))
+
     # NOTE: this is blocking and could cause GUI to freeze, but since there's nothing much else you can do even if it is
     # non-blocking, I do not implement it
     def draw_and_redraw(self):
@@ -547,22 +710,26 @@ class PlotWindow(QWidget):
         for metric in self.metrics:
             if metric.isChecked():
                 active_metrics.append(metric.text())
-        # draw charts
+        # draw the chart shown, the other one is drawn when it is toggled
         df = pd.DataFrame(self.data)[active_fd].loc[active_metrics]
-        self.h_bar_chart_canvas.h_bar_chart(df)
-        self.line_chart_canvas.line_chart(df)
+        if self.line_chart_canvas.isHidden():
+            self.h_bar_chart_canvas.h_bar_chart(df)
+        else:
+            self.line_chart_canvas.line_chart(df)
 
     def toggle_h_bar_chart(self):
         self.line_chart_canvas.hide()
         self.save_line_chart_button.hide()
         self.h_bar_chart_canvas.show()
         self.save_h_bar_chart_button.show()
+        self.draw_and_redraw()
 
     def toggle_line_chart(self):
         self.h_bar_chart_canvas.hide()
         self.save_h_bar_chart_button.hide()
         self.line_chart_canvas.show()
         self.save_line_chart_button.show()
+        self.draw_and_redraw()
 
     def save_h_bar_chart(self):
         name = f"h_bar_{datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f')}.png"
@@ -619,8 +786,8 @@ class MyCanvas(FigureCanvasQTAgg):
             self.ax.legend(reversed(handles), reversed(labels), loc="upper center",
                            bbox_to_anchor=(0.5, -0.07), ncol=len(metrics))
 
-        # draw on canvas
-        self.draw()
+        # draw on canvas, once for a burst of changes (e.g. spinning a weight in the score editor)
+        self.draw_idle()
 
     def line_chart(self, df_):  # mostly from visualization.py -> line_chart
         # clear axes first
@@ -646,8 +813,8 @@ class MyCanvas(FigureCanvasQTAgg):
         if not (x_data.empty or failure_detectors.empty):
             self.ax.legend(loc="upper center", bbox_to_anchor=(0.5, -0.07), ncol=len(failure_detectors))
 
-        # draw on canvas
-        self.draw()
+        # draw on canvas, once for a burst of changes (e.g. spinning a weight in the score editor)
+        self.draw_idle()
 
     def save_fig(self, default_name):
         default_path = os.path.join(os.getcwd(), default_name)
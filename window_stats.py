@@ -0,0 +1,107 @@
+import numpy as np
+
+
+class WindowStats:
+    """
+    This data structure is used to answer, for any window size n and any arrival index k, the questions the FDs ask a
+    Record(n) right after the arrival time k was appended to it: the number, sum and mean of the arrival times it holds,
+    and the number, mean and standard deviation of the valid differences between adjacent arrival times it holds. It is
+    built once per trace from prefix sums of the arrival times, of the differences and of the squared differences, and
+    every query is O(1) per (n, k), so it can be shared by all the n-sweeps of the three estimators.
+
+    The arrival times are detrended by their average interval and the differences are shifted by the first valid one
+    before being summed, so that the prefix sums stay small enough to be exact in float64 even for long traces.
+
+    The arguments n and index of the queries follow the numpy broadcasting rules, e.g. n[:, None] with the default index
+    gives a (len(n), T) table, and a scalar index with an array n gives the state of every window after one arrival.
+    """
+
+    def __init__(self, enviornment):
+        enviornment = np.asarray(enviornment)
+        self.length = len(enviornment)
+        self.origin = enviornment[0]
+        self.index = np.arange(self.length)
+        self.step = (enviornment[-1] - self.origin) / (self.length - 1) if self.length > 1 else 0.0
+        residual = (enviornment - self.origin).astype(np.float64) - self.index * self.step
+        self.arrival_prefix = np.concatenate(([0.0], np.cumsum(residual)))
+
+        difference = np.diff(enviornment).astype(np.float64)
+        valid = difference >= 0
+        self.shift = difference[valid][0] if np.any(valid) else 0.0
+        shifted = np.where(valid, difference - self.shift, 0.0)
+        self.difference = difference
+        self.count_prefix = np.concatenate(([0], np.cumsum(valid)))
+        self.difference_prefix = np.concatenate(([0.0], np.cumsum(shifted)))
+        self.square_prefix = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+
+    def arrival_window(self, n, index=None):
+        """
+        This method is used to get the length and the mean of the arrival times held by a Record(n).
+
+        Args:
+            n (int or np.array): size(s) of the window
+            index (int or np.array): arrival index(es), all of them by default
+
+        Returns:
+            tuple: (length, mean), same as (record.get_length(), record.get_sum() / record.get_length())
+        """
+        if index is None:
+            index = self.index
+        length = np.minimum(index + 1, n)
+        first = index + 1 - length
+        mean = self.origin + self.step * (first + index) / 2 + \
+            (self.arrival_prefix[index + 1] - self.arrival_prefix[first]) / length
+        return length, mean
+
+    def arrival_sum(self, n, index=None):
+        """
+        This method is used to get the sum of the arrival times held by a Record(n).
+
+        Args:
+            n (int or np.array): size(s) of the window
+            index (int or np.array): arrival index(es), all of them by default
+
+        Returns:
+            np.array: same as record.get_sum()
+        """
+        length, mean = self.arrival_window(n, index)
+        return length * mean
+
+    def difference_statistics(self, n, index=None):
+        """
+        This method is used to get the number, the mean and the standard deviation of the valid differences held by a
+        Record(n), i.e. of record.get_difference().
+
+        Args:
+            n (int or np.array): size(s) of the window
+            index (int or np.array): arrival index(es), all of them by default
+
+        Returns:
+            tuple: (count, mean, std), the mean and std are meaningless where count is 0
+        """
+        if index is None:
+            index = self.index
+        # after the arrival time k, the Record holds the differences max(0, k - n + 1) .. k - 1
+        first = np.maximum(index - (np.asarray(n) - 1), 0)
+        count = self.count_prefix[index] - self.count_prefix[first]
+        safe_count = np.maximum(count, 1)
+        shifted_mean = (self.difference_prefix[index] - self.difference_prefix[first]) / safe_count
+        variance = (self.square_prefix[index] - self.square_prefix[first]) / safe_count - shifted_mean * shifted_mean
+        return count, self.shift + shifted_mean, np.sqrt(np.maximum(variance, 0))
+
+    def n_blocks(self, n_array, max_elements=1 << 22):
+        """
+        This method is used to split an array of window sizes into blocks whose (block, T) tables fit in memory.
+
+        Args:
+            n_array (np.array): window sizes
+            max_elements (int): maximum number of elements of one table
+
+        Returns:
+            generator: (slice into n_array, n_array[slice][:, None])
+        """
+        n_array = np.asarray(n_array)
+        block = max(1, max_elements // max(self.length, 1))
+        for start in range(0, len(n_array), block):
+            part = slice(start, start + block)
+            yield part, n_array[part][:, None]